@@ -0,0 +1,143 @@
+""" Adaptive Metropolis sampler for the cosmological parameters.
+
+The gaussian proposal of a random walk Metropolis sampler mixes badly
+when the parameters have very different scales, like omega_m near 0.3
+and H_0 near 70. The adaptive Metropolis algorithm of Haario, Saksman
+and Tamminen (2001) learns the proposal covariance from the history of
+the chain: after adapt_start steps, the proposal covariance is
+
+C_t = s_d Cov(x_0, ..., x_{t-1}) + s_d epsilon I
+
+with s_d = 2.38^2/d. The mean and covariance of the chain are updated
+recursively, so the history is never rescanned.
+"""
+
+import time
+import numpy as np
+from cosmology import mu_model as builtin_mu_model
+from diagnostics import effective_sample_size
+from prior_likelihood import log_posterior
+
+
+def adaptive_metropolis(
+    log_target,
+    initial,
+    iterations,
+    initial_cov=None,
+    adapt_start=1000,
+    adapt_interval=100,
+    epsilon=1e-10,
+    seed=None,
+):
+
+    """ The adaptive Metropolis algorithm.
+
+    Parameter:
+    1. log_target - Function returning the unnormalized log-density of
+    a parameter vector (-inf where the density is 0).
+    2. initial - The starting parameter vector of length d.
+    3. iterations - The number of iterations over which the chain runs.
+    4. initial_cov - The dxd proposal covariance used before adaptation
+    starts. By default the proposal standard deviation of each
+    parameter is 1% of its starting value.
+    5. adapt_start - The number of steps before adaptation starts.
+    6. adapt_interval - The number of steps between two updates of the
+    proposal covariance (and of its Cholesky factor).
+    7. epsilon - Regularization that keeps the covariance positive
+    definite.
+    8. seed - Seed of the np.random.Generator used by the chain.
+
+    Returns a dictionary with the samples (array of shape
+    (iterations, d)), the acceptance rate, the number of log_target
+    calls, the elapsed time, the effective sample size of each
+    parameter and the smallest effective sample size per second.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    x_old = np.array(initial, dtype=float)
+    dim = len(x_old)
+    scale = 2.38 ** 2 / dim
+
+    if initial_cov is None:
+        initial_cov = np.diag((0.01 * np.abs(x_old) + 1e-6) ** 2)
+
+    chol = np.linalg.cholesky(initial_cov)
+
+    # running mean and sum of squared deviations of the chain
+
+    mean = np.zeros(dim)
+    sq_dev = np.zeros((dim, dim))
+
+    samples = np.empty((iterations, dim))
+    accepted = 0
+
+    start_time = time.perf_counter()
+    log_p_old = log_target(x_old)
+    steps = rng.standard_normal((iterations, dim))
+    log_u = np.log(rng.random(iterations))
+
+    for t in range(iterations):
+
+        x_new = x_old + chol @ steps[t]
+        log_p_new = log_target(x_new)
+
+        if log_u[t] < log_p_new - log_p_old:
+            x_old = x_new
+            log_p_old = log_p_new
+            accepted += 1
+
+        samples[t] = x_old
+
+        delta = x_old - mean
+        mean += delta / (t + 1)
+        sq_dev += np.outer(delta, x_old - mean)
+
+        if t + 1 >= adapt_start and (t + 1) % adapt_interval == 0:
+            cov = scale * sq_dev / t + scale * epsilon * np.eye(dim)
+            try:
+                chol = np.linalg.cholesky(cov)
+            except np.linalg.LinAlgError:
+                pass  # keep the previous proposal
+
+    elapsed = time.perf_counter() - start_time
+    ess = effective_sample_size(samples)
+
+    return {
+        "samples": samples,
+        "acceptance_rate": accepted / max(iterations, 1),
+        "log_target_calls": iterations + 1,
+        "elapsed": elapsed,
+        "ess": ess,
+        "ess_per_second": float(np.min(ess)) / elapsed if elapsed > 0 else np.inf,
+    }
+
+
+def sample_cosmology(
+    initial_params,
+    cached_likelihood,
+    magnitude_mode="gaussian",
+    mu_model=builtin_mu_model,
+    iterations=20000,
+    **kwargs
+):
+
+    """ Samples the posterior over omega_m, omega_lambda, H_0 and M.
+
+    Parameter:
+    1. initial_params - The starting list of the 4 parameters.
+    2. cached_likelihood - A prior_likelihood.Likelihood built from the
+    data.
+    3. magnitude_mode - 'uniform' or 'gaussian' prior on M.
+    4. mu_model - The function mu_model(params, data_lcparam), by
+    default the built-in cosmology.mu_model.
+    5. iterations - The number of iterations over which the chain runs.
+    6. kwargs - Passed on to adaptive_metropolis.
+
+    Returns the dictionary of adaptive_metropolis.
+    """
+
+    def log_target(params):
+        return log_posterior(params, magnitude_mode, mu_model, cached_likelihood)
+
+    return adaptive_metropolis(log_target, initial_params, iterations, **kwargs)
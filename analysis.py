@@ -0,0 +1,311 @@
+""" Statistics of spacetime fields
+
+The functions of this module take a spacetime field as a (T, N) uint8
+array, a SpacetimeStore, or a stream of rows or row blocks (e.g.
+iter_spacetime(..., block_size=...)), and read it block by block, so
+fields larger than memory are analysed in O(block_size * N) memory.
+Within a block, every statistic is computed with whole-array
+operations:
+
+- row_density: the fraction of cells in each state, row by row;
+- block_entropy and row_block_entropy: the Shannon entropy of the
+  spatial windows of n cells, encoded as base-k integers and counted
+  with np.bincount;
+- damage and damage_spreading: the Hamming distance between two runs
+  whose initial conditions differ in one cell, with the edges of the
+  damaged region (its light cone), and spreading_rates, the
+  Lyapunov-style exponential growth rate of the damage and the speeds
+  of its edges.
+"""
+import itertools
+import numpy as np
+from general_ca import neighborhood_codes
+from streaming import EntropyEstimator, iter_blocks
+
+# Largest number of window counts held at once by row_block_entropy.
+
+MAX_COUNTS = 1 << 22
+
+
+def iter_row_blocks(source, block_size=4096):
+
+    """Yields a spacetime field as blocks of block_size rows.
+
+    Parameters
+    ----------
+    source: array_like, SpacetimeStore or iterable
+        (T, N) field, or iterable of rows or of (B, N) blocks of rows
+        of any size.
+    block_size: int, optional (default=4096)
+        Number of rows per block; the last block may be shorter. Two
+        fields of the same length read with the same block size give
+        matching blocks.
+
+    Yields
+    ------
+    block: numpy.ndarray
+        (block_size, N) uint8 array of consecutive rows.
+    """
+
+    if not isinstance(block_size, int) or block_size < 1:
+        raise ValueError("block_size must be a positive integer")
+
+    if hasattr(source, "shape"):
+        for start in range(0, source.shape[0], block_size):
+            yield np.asarray(source[start : start + block_size], dtype=np.uint8)
+        return
+
+    items = iter(source)
+    first = next(items, None)
+
+    if first is None:
+        return
+
+    items = itertools.chain([first], items)
+
+    if np.ndim(first) == 1:
+        yield from iter_blocks(items, block_size)
+        return
+
+    # blocks of other sizes are cut and joined into blocks of
+    # block_size rows
+
+    pending = []
+    pending_rows = 0
+
+    for block in items:
+        pending.append(np.asarray(block, dtype=np.uint8))
+        pending_rows += len(block)
+
+        if pending_rows >= block_size:
+            rows = np.concatenate(pending)
+            for start in range(0, pending_rows - block_size + 1, block_size):
+                yield rows[start : start + block_size]
+            pending = [rows[start + block_size :]]
+            pending_rows = len(pending[0])
+
+    if pending_rows:
+        yield np.concatenate(pending)
+
+
+def row_density(source, states=3, block_size=4096):
+
+    """Returns the fraction of cells in each state in every row.
+
+    Returns
+    -------
+    out: numpy.ndarray
+        (T, states) array, whose row t sums to 1.
+    """
+
+    densities = []
+
+    for rows in iter_row_blocks(source, block_size):
+
+        # the cells of row i are counted in bins i*states, ...,
+        # i*states + states - 1
+
+        codes = rows + states * np.arange(len(rows))[:, None]
+        counts = np.bincount(codes.ravel(), minlength=len(rows) * states)
+        densities.append(counts.reshape(-1, states) / max(rows.shape[1], 1))
+
+    if not densities:
+        return np.zeros((0, states))
+
+    return np.concatenate(densities)
+
+
+def block_entropy(source, block_length, states=3, block_size=4096):
+
+    """Returns the spatial n-block entropy of a field in bits.
+
+    The windows of block_length consecutive cells of every row
+    (periodic lattice) are counted over the whole field, as by
+    streaming.EntropyEstimator.
+    """
+
+    estimator = EntropyEstimator(block_length, states)
+
+    for rows in iter_row_blocks(source, block_size):
+        estimator.update(rows)
+
+    return estimator.entropy()
+
+
+def row_block_entropy(source, block_length, states=3, block_size=4096):
+
+    """Returns the spatial n-block entropy of every row in bits.
+
+    Returns
+    -------
+    out: numpy.ndarray
+        (T,) array of entropies.
+    """
+
+    windows = states ** block_length
+    offsets = tuple(range(block_length))
+    rows_per_pass = max(1, MAX_COUNTS // windows)
+    entropies = []
+
+    for block in iter_row_blocks(source, block_size):
+        for start in range(0, len(block), rows_per_pass):
+            rows = block[start : start + rows_per_pass]
+            codes = neighborhood_codes(rows, states, offsets).astype(np.int64)
+            codes += windows * np.arange(len(rows))[:, None]
+
+            counts = np.bincount(codes.ravel(), minlength=len(rows) * windows)
+            probabilities = counts.reshape(len(rows), windows) / max(rows.shape[1], 1)
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                terms = np.where(
+                    probabilities > 0, probabilities * np.log2(1 / probabilities), 0
+                )
+            entropies.append(terms.sum(axis=1))
+
+    if not entropies:
+        return np.zeros(0)
+
+    return np.concatenate(entropies)
+
+
+def perturb(initial_condition, site, states=3):
+
+    """Returns a copy of a configuration whose cell at site is changed
+    to the next state, (value + 1) % states.
+    """
+
+    perturbed = np.array(initial_condition, dtype=np.uint8)
+    perturbed[site] = (perturbed[site] + 1) % states
+
+    return perturbed
+
+
+def damage(source, perturbed_source, site=0, block_size=4096):
+
+    """Compares two runs of the same rule, row by row.
+
+    Parameters
+    ----------
+    source, perturbed_source: array_like, SpacetimeStore or iterable
+        The two fields, as accepted by iter_row_blocks. They are read
+        together, block by block, and must have the same shape.
+    site: int, optional (default=0)
+        Cell at which the initial conditions differ. The edges of the
+        damage are given relative to it.
+
+    Returns
+    -------
+    out: dict
+        "hamming": (T,) array of the number of cells that differ in
+        each row. "left" and "right": (T,) arrays of the offsets, in
+        [-N//2, N - N//2), of the leftmost and rightmost differing
+        cells relative to site (nan for rows without damage).
+    """
+
+    hamming, left, right = [], [], []
+    offsets = None
+
+    for rows, perturbed_rows in zip(
+        iter_row_blocks(source, block_size),
+        iter_row_blocks(perturbed_source, block_size),
+    ):
+        if rows.shape != perturbed_rows.shape:
+            raise ValueError("the two fields must have the same shape")
+
+        if offsets is None:
+            length = rows.shape[1]
+            offsets = (np.arange(length) - site + length // 2) % length - length // 2
+
+        damaged = rows != perturbed_rows
+        hamming.append(damaged.sum(axis=1))
+
+        any_damage = damaged.any(axis=1)
+        lowest = np.where(damaged, offsets, np.iinfo(np.int64).max).min(axis=1)
+        highest = np.where(damaged, offsets, np.iinfo(np.int64).min).max(axis=1)
+        left.append(np.where(any_damage, lowest, np.nan))
+        right.append(np.where(any_damage, highest, np.nan))
+
+    if not hamming:
+        return {
+            "hamming": np.zeros(0, dtype=np.int64),
+            "left": np.zeros(0),
+            "right": np.zeros(0),
+        }
+
+    return {
+        "hamming": np.concatenate(hamming),
+        "left": np.concatenate(left),
+        "right": np.concatenate(right),
+    }
+
+
+def damage_spreading(run, initial_condition, site=None, states=3, block_size=4096):
+
+    """Runs a rule from an initial condition and from the same
+    initial condition with one cell changed, and compares the runs.
+
+    Parameters
+    ----------
+    run: callable
+        Function mapping an initial condition to its field or stream,
+        e.g. lambda init: three_state.iter_spacetime(rule, init, T,
+        block_size=1024).
+    initial_condition: array_like
+        Initial configuration of the unperturbed run.
+    site: int, optional (default=None)
+        Cell changed in the perturbed run (see perturb), by default
+        the middle cell.
+    states: int, optional (default=3)
+        Number of states of the cells.
+
+    Returns
+    -------
+    out: dict
+        The dictionary of damage, with the site added.
+    """
+
+    initial_condition = np.asarray(initial_condition, dtype=np.uint8)
+
+    if site is None:
+        site = len(initial_condition) // 2
+
+    result = damage(
+        run(initial_condition),
+        run(perturb(initial_condition, site, states)),
+        site,
+        block_size,
+    )
+    result["site"] = site
+
+    return result
+
+
+def spreading_rates(result, start=1, stop=None):
+
+    """Returns the growth rates of a damage or damage_spreading result.
+
+    The rates are least squares slopes over the rows start to stop
+    (exclusive) that have damage: "lyapunov", of the logarithm of the
+    Hamming distance, i.e. the exponential rate at which damage grows;
+    and "left_speed" and
+    "right_speed", of the edges of the damage, i.e. the speeds of its
+    light cone (nan when fewer than two rows have damage). Rows after
+    the damage has wrapped around the lattice should be left out with
+    stop.
+    """
+
+    hamming = np.asarray(result["hamming"], dtype=float)[start:stop]
+    times = np.arange(len(hamming)) + start
+    damaged = hamming > 0
+
+    if damaged.sum() < 2:
+        return {"lyapunov": np.nan, "left_speed": np.nan, "right_speed": np.nan}
+
+    def slope(values):
+        return float(np.polyfit(times[damaged], values[damaged], 1)[0])
+
+    return {
+        "lyapunov": slope(np.log(np.where(damaged, hamming, 1))),
+        "left_speed": slope(np.asarray(result["left"], dtype=float)[start:stop]),
+        "right_speed": slope(np.asarray(result["right"], dtype=float)[start:stop]),
+    }
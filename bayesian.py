@@ -22,8 +22,24 @@ know what prior to use. We use a prior such that probability of a<=1 is
 1 for all other values of a.
 """
 
+import argparse
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import matplotlib.pyplot as plt
+from numpy.lib.format import open_memmap
+from diagnostics import OnlineChainStats, split_rhat
+from instrumentation import phase
+
+# Number of proposals and uniforms drawn at a time by the sampler.
+
+BLOCK_SIZE = 65536
+
+# Number of proposals (and of uniforms) drawn at a time for all the
+# chains of an ensemble together, 8 MiB of each.
+
+ENSEMBLE_BLOCK_VALUES = 2 ** 20
 
 
 def post_a_x(a_value, sq_sum_data, length):
@@ -48,91 +64,708 @@ def post_a_x(a_value, sq_sum_data, length):
     )
 
 
-def metropolis_hastings(iterations, initial_a, data):
+def log_post_a_x(a_value, sq_sum_data, length):
+
+    """ Calculating the logarithm of the posterior P(a|{x})
+
+    log P(a|{x}) = (n/2) * log(log(a)/(2*pi)) - (x_1^2+x_2^2 + ... + x_n^2)/2 * log(a)
+
+    Unlike post_a_x, this does not underflow for large datasets. It
+    returns -inf for a <= 1, where the prior is 0.
+
+    Parameters: same as post_a_x.
+    """
+
+    if a_value <= 1:
+        return -math.inf
+
+    log_a = math.log(a_value)
+
+    return length / 2 * math.log(log_a / (2 * math.pi)) - sq_sum_data / 2 * log_a
+
+
+def log_post_a_x_array(a_values, sq_sum_data, length):
+
+    """ Calculating log P(a|{x}) for an array of values of a
+
+    Same as log_post_a_x, evaluated elementwise. Entries with a <= 1
+    are -inf.
+    """
+
+    a_values = np.asarray(a_values, dtype=float)
+    log_post = np.full(a_values.shape, -np.inf)
+
+    valid = a_values > 1
+    log_a = np.log(a_values[valid])
+    log_post[valid] = length / 2 * np.log(log_a / (2 * np.pi)) - sq_sum_data / 2 * log_a
+
+    return log_post
+
+
+def sufficient_statistics(data):
+
+    """ Returns the sum of the squares of the x datapoints and their
+    number, which is all the posterior depends on.
+    """
+
+    data = np.asarray(data, dtype=float).ravel()
+
+    return float(np.dot(data, data)), len(data)
+
+
+def default_grid(sq_sum_data, length, size=10 ** 6, width=12):
+
+    """ A grid of values of a that holds all the posterior mass
+
+    With u = log(a), the posterior density of u is proportional to
+    u^{n/2} e^{-(S/2-1)u} for u > 0, where S is the sum of the squares
+    of the datapoints, i.e. u follows a Gamma distribution of shape
+    n/2+1 and rate S/2-1. The grid covers its mean plus or minus width
+    standard deviations, mapped back to a.
+
+    Parameters:
+
+    1. sq_sum_data, length - As in post_a_x. S/2 must be larger than 1
+       for the posterior to be normalizable.
+    2. size - The number of grid points.
+    3. width - The half-width of the grid in standard deviations of u.
+    """
+
+    rate = sq_sum_data / 2 - 1
+
+    if rate <= 0:
+        raise ValueError("the posterior is not normalizable for this data")
+
+    shape = length / 2 + 1
+    mean = shape / rate
+    std = math.sqrt(shape) / rate
+
+    log_a = np.linspace(max(mean - width * std, 0), mean + width * std, size)
+
+    return np.exp(log_a)
+
+
+def posterior_grid(data, a_values=None):
+
+    """ Normalized posterior P(a|{x}) on a grid of values of a
+
+    The log-posterior is evaluated on the whole grid at once, shifted
+    by its maximum before exponentiating (so it never underflows),
+    and normalized with the trapezoid rule. The CDF is the cumulative
+    trapezoid integral of the density.
+
+    Parameters:
+
+    1. data - The x datapoints.
+    2. a_values - Increasing grid of values of a. By default, the
+       million-point default_grid of the data.
+
+    Returns a dictionary with the grid "a", the normalized "density"
+    and the "cdf" at every grid point.
+    """
+
+    sq_sum_data, length = sufficient_statistics(data)
+
+    if a_values is None:
+        a_values = default_grid(sq_sum_data, length)
+
+    a_values = np.asarray(a_values, dtype=float)
+    log_post = log_post_a_x_array(a_values, sq_sum_data, length)
+    density = np.exp(log_post - log_post.max())
+
+    areas = (density[1:] + density[:-1]) * np.diff(a_values) / 2
+    cdf = np.concatenate(([0.0], np.cumsum(areas)))
+
+    total = cdf[-1]
+
+    return {"a": a_values, "density": density / total, "cdf": cdf / total}
+
+
+def posterior_quantiles(data, probabilities, grid=None):
+
+    """ Quantiles of the posterior P(a|{x})
+
+    The quantiles are found by inverting the CDF of posterior_grid by
+    linear interpolation, which on the default million-point grid is
+    exact to far better than the Monte Carlo error of any chain. They
+    can be compared with np.quantile of the samples of a chain.
+
+    Parameters:
+
+    1. data - The x datapoints.
+    2. probabilities - Probability or array of probabilities in [0, 1].
+    3. grid - A dictionary returned by posterior_grid for the same
+       data, to reuse. By default, posterior_grid(data).
+    """
+
+    if grid is None:
+        grid = posterior_grid(data)
+
+    return np.interp(probabilities, grid["cdf"], grid["a"])
+
+
+def _mh_block(a_old, log_p_old, steps, log_u, sq_sum_data, length):
+
+    """ Runs the Metropolis-Hastings chain over one block of draws
+
+    Parameters:
+
+    1. a_old, log_p_old - The current state of the chain and its
+       log-posterior.
+    2. steps - The gaussian steps of the proposals of the block.
+    3. log_u - The logarithms of the uniform draws of the block.
+    4. sq_sum_data, length - As in post_a_x.
+
+    Returns the list of states of the chain after each step, the
+    final state, its log-posterior and the number of accepted
+    proposals.
+    """
+
+    samples = []
+    accepted = 0
+
+    for step, log_uniform in zip(steps.tolist(), log_u.tolist()):
+
+        a_new = a_old + step
+
+        # Points a_new <= 1 have zero posterior and are never accepted.
+        # Otherwise accept with probability min(1, P(a_new|x)/P(a_old|x)).
+
+        if a_new > 1:
+            log_p_new = log_post_a_x(a_new, sq_sum_data, length)
+            if log_uniform < log_p_new - log_p_old:
+                a_old = a_new
+                log_p_old = log_p_new
+                accepted += 1
+
+        samples.append(a_old)
+
+    return samples, a_old, log_p_old, accepted
+
+
+def metropolis_hastings(iterations, initial_a, data, seed=None, instrument=None):
 
     """ The Metropolis-Hastings Algorithm
 
+    The chain works with log-posteriors and keeps the log-posterior of
+    the current state, so each step evaluates the posterior once. The
+    gaussian proposals (mean a_old, variance 1) and the uniforms of the
+    accept/reject test are drawn in blocks of BLOCK_SIZE.
+
     Parameters:
 
     1. iterations - The number of iterations over which the chain runs.
     2. initial_a - The starting value of a for the mcmc chain.
-    3. sq_sum_data - Importing the sum of the square of x values of the
-       datapoints. Not importing the individual datapoints as that is
-       unnecessary.
-    4. length - The number of x datapoints.
+    3. data - The x datapoints.
+    4. seed - Seed of the np.random.Generator used by the chain.
+    5. instrument - An optional instrumentation.Instrument, which gets
+       the steps, accepted proposals, posterior evaluations and size
+       of the trace every instrument.every steps, and the time spent
+       drawing random numbers ("draw") and running the chain
+       ("sample"). The chain is the same with or without it.
+
+    Returns an array of the estimates of e at each iteration.
     """
 
-    a_old = initial_a  # old data point
+    rng = np.random.default_rng(seed)
 
-    e_est = []  # list of the estimates for e at each iteration
+    data = np.asarray(data, dtype=float)
 
-    sum_sq_data = sum(
-        map(lambda x: x * x, data)
-    )  # sum of the square of the x datapoints
+    sum_sq_data = float(np.dot(data, data))  # sum of the square of the x datapoints
 
     length = len(data)  # number of datapoints
 
-    for _ in range(iterations):
+    e_est = np.empty(iterations)  # the estimates for e at each iteration
+
+    a_old = float(initial_a)  # old data point
 
-        # Choose a new data point using the generating function
-        # which is a gaussian with mean a_old and variance 1.
+    log_p_old = log_post_a_x(a_old, sum_sq_data, length)
 
-        a_new = np.random.randn() + a_old
+    if instrument is not None:
+        instrument.start("metropolis_hastings", iterations)
+        instrument.step(0, evaluations=1, memory_bytes=e_est.nbytes)
 
-        if a_new <= 1:
+    # with an instrument, each block is run in pieces of
+    # instrument.every steps to report progress; the draws, and so the
+    # chain, do not change
 
-            pass  # Do not accept the new data point if it is < 1
+    piece_size = BLOCK_SIZE if instrument is None else instrument.every
 
-        elif (
-            post_a_x(a_new, sum_sq_data, length) / post_a_x(a_old, sum_sq_data, length)
-            >= 1
-        ):
+    for start in range(0, iterations, BLOCK_SIZE):
 
-            # accept the new data point if it P(a_new|x) > P(a_old|x)
+        block = min(BLOCK_SIZE, iterations - start)
 
-            a_old = a_new
+        with phase(instrument, "draw"):
+            steps = rng.standard_normal(block)
+            log_u = np.log(rng.random(block))
 
-        elif np.random.uniform(0, 1) < post_a_x(a_new, sum_sq_data, length) / post_a_x(
-            a_old, sum_sq_data, length
-        ):
+        for piece in range(0, block, piece_size):
 
-            # accept the new data point with a probablity
-            # given by P(a_new|x)/P(a_old|x) which is less than 1
+            stop = min(piece + piece_size, block)
+            a_first = a_old
 
-            a_old = a_new
+            with phase(instrument, "sample"):
+                samples, a_old, log_p_old, accepted = _mh_block(
+                    a_old,
+                    log_p_old,
+                    steps[piece:stop],
+                    log_u[piece:stop],
+                    sum_sq_data,
+                    length,
+                )
+            e_est[start + piece : start + stop] = samples
 
-        e_est.append(a_old)  # append the current value of a to the list
+            if instrument is not None:
+
+                # the posterior is evaluated at every proposal a > 1
+
+                previous = np.concatenate(([a_first], samples[:-1]))
+                evaluations = int(np.count_nonzero(previous + steps[piece:stop] > 1))
+                instrument.step(stop - piece, accepted, evaluations)
+
+    if instrument is not None:
+        instrument.finish()
 
     return e_est
 
 
-def plot_post_a_x(a_array, x_data):
+def _chain_generators(seed_sequence):
 
-    """ Plot the posterior probability of a given x
+    """ Returns the two generators of a chain
+
+    The gaussian steps and the uniforms are drawn from two streams
+    derived from the seed sequence of the chain (its first two spawned
+    children, without spawning from it), so the states of the chain do
+    not depend on how many draws are made at a time.
     """
 
-    sum_sq_data = sum(map(lambda x: x * x, x_data))
+    return [
+        np.random.default_rng(
+            np.random.SeedSequence(
+                seed_sequence.entropy, spawn_key=seed_sequence.spawn_key + (child,)
+            )
+        )
+        for child in range(2)
+    ]
 
-    plt.plot(
-        a_array, list(map(lambda y: post_a_x(y, sum_sq_data, len(x_data)), a_array))
-    )
+
+def _chain_blocks(
+    iterations,
+    initial_a,
+    sq_sum_data,
+    length,
+    seed_sequences,
+    block_size=None,
+    piece_size=None,
+):
+
+    """ Advances a group of chains in lockstep, one block at a time
+
+    Parameters:
+
+    1. iterations - The number of iterations over which the chains run.
+    2. initial_a - Array of the starting values of the chains.
+    3. sq_sum_data, length - As in post_a_x.
+    4. seed_sequences - One np.random.SeedSequence per chain. Each
+       chain draws from its own streams (see _chain_generators), so its
+       samples do not depend on which other chains it is run with, nor
+       on the block size.
+    5. block_size - The number of iterations per block, by default
+       ENSEMBLE_BLOCK_VALUES // chains, so that the arrays of one block
+       hold about ENSEMBLE_BLOCK_VALUES values whatever the number of
+       chains.
+    6. piece_size - If given, the blocks are yielded in pieces that
+       end every piece_size iterations (counted from the start of the
+       chains) and at the end of each block.
+
+    Yields an array of shape (chains, piece) of the states of the
+    chains and an array of the number of accepted proposals of each
+    chain, for every block or piece.
+    """
+
+    chains = len(seed_sequences)
+
+    if block_size is None:
+        block_size = max(1, ENSEMBLE_BLOCK_VALUES // chains)
+
+    generators = [_chain_generators(sequence) for sequence in seed_sequences]
+
+    a_old = np.array(initial_a, dtype=float)
+    log_p_old = log_post_a_x_array(a_old, sq_sum_data, length)
+
+    for start in range(0, iterations, block_size):
+
+        # the draws and states are stored time-major, so every step
+        # reads and writes contiguous rows
+
+        block = min(block_size, iterations - start)
+        steps = np.empty((block, chains))
+        log_u = np.empty((block, chains))
+        for chain, (step_generator, uniform_generator) in enumerate(generators):
+            steps[:, chain] = step_generator.standard_normal(block)
+            log_u[:, chain] = np.log(uniform_generator.random(block))
+
+        samples = np.empty((block, chains))
+        accepted = np.zeros(chains, dtype=int)
+        piece_start = 0
+
+        for i in range(block):
+
+            # accept/reject every chain at once with a mask
+
+            a_new = a_old + steps[i]
+            log_p_new = log_post_a_x_array(a_new, sq_sum_data, length)
+            accept = log_u[i] < log_p_new - log_p_old
+
+            a_old = np.where(accept, a_new, a_old)
+            log_p_old = np.where(accept, log_p_new, log_p_old)
+            samples[i] = a_old
+            accepted += accept
+
+            if i == block - 1 or (
+                piece_size is not None and (start + i + 1) % piece_size == 0
+            ):
+                yield samples[piece_start : i + 1].T, accepted
+                accepted = np.zeros(chains, dtype=int)
+                piece_start = i + 1
+
+
+def _run_chains(iterations, initial_a, sq_sum_data, length, seed_sequences):
+
+    """ Runs a group of chains for the given number of iterations
+
+    Parameters: as in _chain_blocks.
+
+    Returns an array of shape (chains, iterations).
+    """
+
+    blocks = _chain_blocks(iterations, initial_a, sq_sum_data, length, seed_sequences)
+
+    e_est = np.empty((len(seed_sequences), iterations))
+    start = 0
+
+    for samples, _ in blocks:
+        e_est[:, start : start + samples.shape[1]] = samples
+        start += samples.shape[1]
+
+    return e_est
+
+
+def metropolis_hastings_ensemble(
+    iterations, initial_a, data, chains=1000, seed=None, workers=1
+):
+
+    """ Many independent Metropolis-Hastings chains in parallel
+
+    The chains are advanced in lockstep as one numpy vector, in blocks
+    of ENSEMBLE_BLOCK_VALUES // chains iterations, so the memory beyond
+    the result stays bounded. Chain m draws from streams derived from
+    the m-th sequence spawned from np.random.SeedSequence(seed), so the
+    result does not depend on the number of workers.
+
+    Parameters:
+
+    1. iterations - The number of iterations over which the chains run.
+    2. initial_a - The starting value of a, either one value for all
+       chains or one value per chain.
+    3. data - The x datapoints.
+    4. chains - The number M of chains.
+    5. seed - Seed from which the streams of the chains are spawned.
+    6. workers - The number of processes the chains are split across.
+
+    Returns an array of shape (M, iterations) of the estimates of e.
+    """
+
+    data = np.asarray(data, dtype=float)
+    sum_sq_data = float(np.dot(data, data))
+
+    initial_a = np.broadcast_to(np.asarray(initial_a, dtype=float), (chains,))
+    seed_sequences = np.random.SeedSequence(seed).spawn(chains)
+
+    if workers == 1:
+        return _run_chains(
+            iterations, initial_a, sum_sq_data, len(data), seed_sequences
+        )
+
+    groups = np.array_split(np.arange(chains), workers)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            _run_chains,
+            [iterations] * len(groups),
+            [initial_a[group] for group in groups],
+            [sum_sq_data] * len(groups),
+            [len(data)] * len(groups),
+            [[seed_sequences[m] for m in group] for group in groups],
+        )
+        return np.concatenate(list(results))
+
+
+def metropolis_hastings_until_converged(
+    initial_a,
+    data,
+    chains=4,
+    target_ess=None,
+    max_rhat=None,
+    max_iterations=10 ** 7,
+    check_every=1000,
+    seed=None,
+    keep_samples=True,
+    require="all",
+):
+
+    """ Metropolis-Hastings chains that stop once they have converged
+
+    The chains are advanced, and their random numbers drawn, as in
+    metropolis_hastings_ensemble, so with the same seed and number of
+    chains the samples are the first iterations of the ensemble,
+    whatever check_every is. After every check_every iterations the
+    streaming diagnostics of diagnostics.OnlineChainStats are checked:
+    running mean and variance, batch-means effective sample size,
+    split-R-hat across chains and acceptance rate. The run stops as
+    soon as the given targets are reached (all of them, or any one of
+    them, see require), or after max_iterations.
+
+    Parameters:
+
+    1. initial_a - The starting value of a, either one value for all
+       chains or one value per chain.
+    2. data - The x datapoints.
+    3. chains - The number M of chains. Split-R-hat needs M >= 2, so
+       max_rhat can only be given with at least 2 chains.
+    4. target_ess - Stop once the ESS summed over the chains reaches
+       this value.
+    5. max_rhat - Stop once split-R-hat is at most this value.
+    6. max_iterations - The largest number of iterations per chain.
+    7. check_every - The number of iterations between two checks.
+    8. seed - Seed from which the streams of the chains are spawned.
+    9. keep_samples - If False, the samples are not kept and only the
+       diagnostics are returned, so memory does not grow with the
+       number of iterations.
+    10. require - When both targets are given, "all" (the default)
+        stops once both are reached, and "any" once either is.
+
+    Returns an array of shape (M, iterations) of the estimates of e (or
+    None if keep_samples is False) and a dictionary of the diagnostics.
+    """
+
+    if target_ess is None and max_rhat is None:
+        raise ValueError("at least one of target_ess and max_rhat must be given")
+    if max_rhat is not None and chains < 2:
+        raise ValueError("max_rhat needs at least 2 chains for split-R-hat")
+    if require not in ("all", "any"):
+        raise ValueError("require must be 'all' or 'any'")
+
+    data = np.asarray(data, dtype=float)
+    sum_sq_data = float(np.dot(data, data))
+
+    initial_a = np.broadcast_to(np.asarray(initial_a, dtype=float), (chains,))
+    seed_sequences = np.random.SeedSequence(seed).spawn(chains)
+
+    stats = [OnlineChainStats() for _ in range(chains)]
+    accepted = np.zeros(chains, dtype=int)
+    blocks_kept = [np.empty((chains, 0))]
+    iterations = 0
+    converged = False
+    ess = rhat = np.nan
+
+    for samples, block_accepted in _chain_blocks(
+        max_iterations,
+        initial_a,
+        sum_sq_data,
+        len(data),
+        seed_sequences,
+        piece_size=check_every,
+    ):
+
+        for chain_stats, chain_samples in zip(stats, samples):
+            chain_stats.update(chain_samples)
+
+        accepted += block_accepted
+        iterations += samples.shape[1]
+
+        if keep_samples:
+            blocks_kept.append(samples)
+
+        # pieces also end with the draw blocks, between two checks
+
+        if iterations % check_every and iterations < max_iterations:
+            continue
+
+        ess = float(np.sum([chain_stats.ess() for chain_stats in stats]))
+        rhat = split_rhat(stats) if chains > 1 else np.nan
+
+        reached = [
+            ess >= target_ess if target_ess is not None else None,
+            rhat <= max_rhat if max_rhat is not None else None,
+        ]
+        reached = [target for target in reached if target is not None]
+        converged = all(reached) if require == "all" else any(reached)
+
+        if converged:
+            break
+
+    diagnostics = {
+        "iterations": iterations,
+        "converged": converged,
+        "ess": ess,
+        "rhat": rhat,
+        "acceptance_rate": accepted / max(iterations, 1),
+        "mean": np.array([chain_stats.mean for chain_stats in stats]),
+        "variance": np.array([chain_stats.variance for chain_stats in stats]),
+    }
+
+    if not keep_samples:
+        return None, diagnostics
+
+    return np.concatenate(blocks_kept, axis=1), diagnostics
+
+
+def metropolis_hastings_checkpointed(
+    iterations, initial_a, data, path, seed=None, chunk_size=BLOCK_SIZE
+):
+
+    """ The Metropolis-Hastings Algorithm with checkpoints on disk
+
+    The samples are appended chunk by chunk to a memory-mapped .npy
+    file at path, and after every chunk a checkpoint of the state of
+    the chain (current a_old, random generator state and progress) is
+    written to path + ".ckpt". If the process dies, the chain is
+    continued with resume_metropolis_hastings(path). Memory use does
+    not grow with the number of iterations.
+
+    Parameters:
+
+    1. iterations, initial_a, data, seed - As in metropolis_hastings.
+       With the default chunk_size, the chain is the same as the one of
+       metropolis_hastings with the same seed.
+    2. path - Path of the .npy file of the samples.
+    3. chunk_size - The number of iterations between two checkpoints.
+
+    Returns the samples as a read-only memory-mapped array.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    data = np.asarray(data, dtype=float)
+
+    samples = open_memmap(path, mode="w+", dtype=float, shape=(iterations,))
+    del samples
+
+    checkpoint = {
+        "iterations": iterations,
+        "done": 0,
+        "chunk_size": chunk_size,
+        "a_old": float(initial_a),
+        "sq_sum_data": float(np.dot(data, data)),
+        "length": len(data),
+        "rng_state": rng.bit_generator.state,
+    }
+    _write_checkpoint(path, checkpoint)
+
+    return _continue_chain(path, checkpoint)
+
+
+def resume_metropolis_hastings(path):
+
+    """ Continues a chain of metropolis_hastings_checkpointed
+
+    The chain is continued from its last checkpoint and is the same,
+    bit for bit, as if it had never been interrupted.
+
+    Returns the samples as a read-only memory-mapped array.
+    """
+
+    with open(path + ".ckpt") as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+
+    return _continue_chain(path, checkpoint)
+
+
+def _continue_chain(path, checkpoint):
+
+    """ Runs a checkpointed chain from its checkpoint to the end"""
+
+    rng = np.random.default_rng()
+    rng.bit_generator.state = checkpoint["rng_state"]
+
+    samples = np.load(path, mmap_mode="r+")
+
+    sq_sum_data = checkpoint["sq_sum_data"]
+    length = checkpoint["length"]
+    iterations = checkpoint["iterations"]
+    chunk_size = checkpoint["chunk_size"]
+
+    a_old = checkpoint["a_old"]
+    log_p_old = log_post_a_x(a_old, sq_sum_data, length)
+
+    for start in range(checkpoint["done"], iterations, chunk_size):
+
+        block = min(chunk_size, iterations - start)
+        steps = rng.standard_normal(block)
+        log_u = np.log(rng.random(block))
+
+        chunk, a_old, log_p_old, _ = _mh_block(
+            a_old, log_p_old, steps, log_u, sq_sum_data, length
+        )
+
+        # the samples reach the disk before the checkpoint that
+        # counts them
+
+        samples[start : start + block] = chunk
+        samples.flush()
+
+        checkpoint["done"] = start + block
+        checkpoint["a_old"] = a_old
+        checkpoint["rng_state"] = rng.bit_generator.state
+        _write_checkpoint(path, checkpoint)
+
+    del samples
+
+    return np.load(path, mmap_mode="r")
+
+
+def _write_checkpoint(path, checkpoint):
+
+    """ Atomically replaces the checkpoint of the chain at path"""
+
+    with open(path + ".ckpt.tmp", "w") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+
+    os.replace(path + ".ckpt.tmp", path + ".ckpt")
+
+
+def plot_post_a_x(a_array, x_data, path="post_prob_analytical.jpg"):
+
+    """ Plot the normalized posterior probability of a given x
+    """
+
+    import matplotlib.pyplot as plt
+
+    grid = posterior_grid(x_data, a_array)
+
+    plt.plot(grid["a"], grid["density"])
     plt.xlabel("a")
-    plt.ylabel("posterior probability")
-    plt.savefig("post_prob_analytical.jpg")
+    plt.ylabel("posterior probability density")
+    plt.savefig(path)
     plt.close()
 
 
-def plot_trace_histogram(post_e):
+def plot_trace_histogram(
+    post_e, trace_path="trace_plot.jpg", hist_path="histogram.jpg"
+):
 
     """ Plot the trace plot and histogram
     """
 
+    import matplotlib.pyplot as plt
+
     # Plotting the trace plot
 
     plt.plot(np.arange(0, len(post_e)), post_e)
     plt.xlabel("Iteration")
     plt.ylabel("Parameter Value")
-    plt.savefig("trace_plot.jpg")
+    plt.savefig(trace_path)
     plt.close()
 
     # Plotting the histogram
@@ -140,32 +773,63 @@ def plot_trace_histogram(post_e):
     plt.hist(post_e, bins="auto")
     plt.xlabel("parameter")
     plt.ylabel("posterior probability distribution")
-    plt.savefig("histogram.jpg")
+    plt.savefig(hist_path)
     plt.close()
 
 
-# Drawing 100 random samples of x from a gaussian of mean zero
-# and unit variance
+def main(argv=None):
 
-X_DATA = np.random.randn(100)  # drawing
+    """ Command line entry point
 
-# defining the values of a over which the analytical posterior
-# probability is calculted
+    Draws the data, runs the Metropolis-Hastings chain and writes the
+    analytical posterior, trace plot and histogram into the output
+    directory. With --batch, no plot is made (and matplotlib is not
+    imported); the posterior mean and standard deviation of a are
+    printed instead.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--length", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--initial-a", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--batch", action="store_true")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
 
-A_ARRAY = np.arange(1.5, 6, 0.01)
+    # Drawing random samples of x from a gaussian of mean zero
+    # and unit variance
 
-# plotting the analytical posterior probability
+    x_data = rng.standard_normal(args.length)
 
-plot_post_a_x(A_ARRAY, X_DATA)
+    # Running the Metropolis-Hastings algorithm, with a seed derived
+    # from the one of the data
 
-# Running the Metropolis-Hastings algorithm
+    post_e = metropolis_hastings(
+        args.iterations, args.initial_a, x_data, seed=rng.integers(2 ** 63)
+    )
 
-ITER_NUM = 20000  # number of iterations
+    if args.batch:
+        print("mean:", post_e.mean())
+        print("std:", post_e.std())
+        return
 
-INIT_A = 10  # the initial value of a for the chain
+    # plotting the analytical posterior probability over a range of a,
+    # the trace plot and the histogram
 
-POST_E = metropolis_hastings(ITER_NUM, INIT_A, X_DATA)
+    plot_post_a_x(
+        np.arange(1.5, 6, 0.01),
+        x_data,
+        path=os.path.join(args.output_dir, "post_prob_analytical.jpg"),
+    )
+    plot_trace_histogram(
+        post_e,
+        trace_path=os.path.join(args.output_dir, "trace_plot.jpg"),
+        hist_path=os.path.join(args.output_dir, "histogram.jpg"),
+    )
 
-# Plotting the trace plot and the histogram
 
-plot_trace_histogram(POST_E)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+""" Benchmarks of the CA engines, samplers and likelihoods
+
+Each benchmark times one entry point of the repository over a scaling
+axis (lattice width, time steps, iterations, data size or covariance
+dimension) and reports its throughput (cells/sec, samples/sec or
+evaluations/sec) and the peak memory allocated by one call, as
+measured with tracemalloc. Results can be saved as a JSON baseline, and
+a later run is compared against the stored baseline: a benchmark whose
+median throughput drops by more than the tolerance plus its measured
+spread, or whose peak memory grows by more than the tolerance, is
+reported as a regression and the exit status is 1.
+
+    python benchmarks.py --save          # record the baseline
+    python benchmarks.py                 # compare against it
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import bayesian
+import three_state
+import two_state
+from cosmology import mu_model
+from data_loader import LightCurveData
+from prior_likelihood import Likelihood, likelihood
+
+# Default location of the baseline, next to this file.
+
+BASELINE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".benchmarks.json"
+)
+
+# Sizes of each scaling axis; --quick keeps the first two.
+
+WIDTHS = [64, 256, 1024, 4096]
+STEPS = [64, 256, 1024, 4096]
+ITERATIONS = [10 ** 4, 10 ** 5, 10 ** 6]
+DATA_SIZES = [10 ** 2, 10 ** 4, 10 ** 6]
+DIMENSIONS = [40, 160, 640]
+
+# Cosmological parameters omega_m, omega_lambda, H_0 and M of the
+# likelihood benchmarks.
+
+PARAMS = [0.3, 0.7, 70, -19.3]
+
+
+def _spacetime_field(length, time_steps):
+
+    init = np.random.default_rng(0).integers(0, 2, length).tolist()
+
+    def run():
+        two_state.spacetime_field(110, init, time_steps)
+
+    return run, length * (time_steps + 1), "cells"
+
+
+def _three_state_evolve(length, time_steps):
+
+    init = np.random.default_rng(0).integers(0, 3, length).tolist()
+
+    def run():
+        three_state.ThreeStateCA(1234, init).evolve(time_steps)
+
+    return run, length * (time_steps + 1), "cells"
+
+
+def _metropolis_hastings(iterations, data_size):
+
+    data = np.random.default_rng(0).standard_normal(data_size)
+
+    def run():
+        bayesian.metropolis_hastings(iterations, 10, data, seed=0)
+
+    return run, iterations, "samples"
+
+
+def _synthetic_data(dimension):
+
+    """Returns light curve data and a systematic error matrix of the
+    given dimension, with random redshifts and magnitudes.
+    """
+
+    rng = np.random.default_rng(0)
+    redshift = np.sort(rng.uniform(0.01, 2, dimension))
+    magnitude = mu_model(PARAMS, LightCurveData({"zcmb": redshift})) + PARAMS[3]
+    factor = rng.normal(0, 0.01, (dimension, dimension))
+
+    data = LightCurveData(
+        {
+            "zcmb": redshift,
+            "mb": magnitude + rng.normal(0, 0.1, dimension),
+            "dmb": rng.uniform(0.05, 0.2, dimension),
+        }
+    )
+
+    return data, factor @ factor.T
+
+
+def _likelihood(dimension):
+
+    data, sys_error = _synthetic_data(dimension)
+
+    def run():
+        likelihood(PARAMS, mu_model, data, sys_error, True)
+
+    return run, 1, "evaluations"
+
+
+def _cached_likelihood(dimension):
+
+    data, sys_error = _synthetic_data(dimension)
+    cached = Likelihood(data, sys_error, True)
+
+    def run():
+        cached.log_likelihood(PARAMS, mu_model)
+
+    return run, 1, "evaluations"
+
+
+# The benchmarks: name, scaling axis, sizes, and a factory that takes a
+# size and returns the function to time, the units of work of one call
+# and the name of the unit.
+
+CASES = [
+    ("two_state.spacetime_field", "width", WIDTHS, lambda n: _spacetime_field(n, 256)),
+    ("two_state.spacetime_field", "steps", STEPS, lambda t: _spacetime_field(256, t)),
+    ("ThreeStateCA.evolve", "width", WIDTHS, lambda n: _three_state_evolve(n, 256)),
+    ("ThreeStateCA.evolve", "steps", STEPS, lambda t: _three_state_evolve(256, t)),
+    (
+        "metropolis_hastings",
+        "iterations",
+        ITERATIONS,
+        lambda i: _metropolis_hastings(i, 100),
+    ),
+    (
+        "metropolis_hastings",
+        "data_size",
+        DATA_SIZES,
+        lambda n: _metropolis_hastings(10 ** 5, n),
+    ),
+    ("likelihood", "dimension", DIMENSIONS, _likelihood),
+    ("Likelihood.log_likelihood", "dimension", DIMENSIONS, _cached_likelihood),
+]
+
+
+def measure(function, work, repeat=15, min_time=1.0, sample_time=0.02):
+
+    """Times a function and measures its peak memory.
+
+    Parameters
+    ----------
+    function: callable
+        Function called without arguments.
+    work: int
+        Units of work done by one call.
+    repeat: int, optional (default=15)
+        Number of timed samples. More are taken while the total time
+        stays under min_time, and fewer, but at least 5, once it passes
+        10 * min_time. The median is kept, so a few slow samples (other
+        processes, frequency changes) do not move the result.
+    min_time: float, optional (default=1.0)
+        Smallest total time of the samples in seconds.
+    sample_time: float, optional (default=0.02)
+        Smallest time of one sample in seconds. Fast functions are
+        called several times per sample, so that each sample is well
+        above the resolution and the jitter of the timer.
+
+    Returns
+    -------
+    out: dict
+        The median time of one call in seconds, the throughput in units
+        per second, the spread of the samples (their interquartile
+        range relative to the median) and the peak memory allocated by
+        one call in bytes.
+    """
+
+    # one untimed call warms up caches and gives the number of calls
+    # per sample; a second, traced, call gives the peak memory
+    # (tracemalloc slows it down too much to time it)
+
+    start = time.perf_counter()
+    function()
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    number = max(1, int(np.ceil(sample_time / elapsed)))
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    samples = []
+    total = 0.0
+
+    while len(samples) < 5 or (
+        (len(samples) < repeat or total < min_time) and total < 10 * min_time
+    ):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        samples.append(elapsed / number)
+        total += elapsed
+
+    median = float(np.median(samples))
+    quartiles = np.percentile(samples, [25, 75])
+
+    return {
+        "seconds": median,
+        "rate": work / median,
+        "spread": float(quartiles[1] - quartiles[0]) / median,
+        "peak_bytes": peak,
+    }
+
+
+def run_benchmarks(quick=False, only=None, progress=None):
+
+    """Runs the benchmarks whose name contains only (all by default).
+
+    Returns a list of result dictionaries with the keys name, axis,
+    size, unit, seconds, rate and peak_bytes.
+    """
+
+    results = []
+
+    for name, axis, sizes, factory in CASES:
+        if only is not None and only not in name:
+            continue
+
+        for size in sizes[:2] if quick else sizes:
+            function, work, unit = factory(size)
+            result = {"name": name, "axis": axis, "size": size, "unit": unit}
+            result.update(measure(function, work))
+            results.append(result)
+
+            if progress is not None:
+                progress(result)
+
+    return results
+
+
+def _key(result):
+
+    return "{}[{}={}]".format(result["name"], result["axis"], result["size"])
+
+
+def save_baseline(results, path=BASELINE_PATH):
+
+    """Writes the results to a JSON baseline file."""
+
+    with open(path + ".tmp", "w") as baseline_file:
+        json.dump({_key(result): result for result in results}, baseline_file)
+
+    os.replace(path + ".tmp", path)
+
+
+def load_baseline(path=BASELINE_PATH):
+
+    """Reads a JSON baseline file."""
+
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def compare(results, baseline, tolerance=0.25):
+
+    """Compares results with a baseline.
+
+    Returns a list of messages, one per benchmark whose median
+    throughput is below (1 - tolerance - spread) times, or whose peak
+    memory is above (1 + tolerance) times, that of the baseline. The
+    spread is three times the larger relative interquartile range of
+    the two measurements, so a benchmark that is noisy on this machine
+    must slow down further before it is reported. Benchmarks missing
+    from the baseline are not compared.
+    """
+
+    regressions = []
+
+    for result in results:
+        reference = baseline.get(_key(result))
+        if reference is None:
+            continue
+
+        spread = 3 * max(result.get("spread", 0), reference.get("spread", 0))
+        threshold = max(1 - tolerance - spread, 0)
+
+        if result["rate"] < threshold * reference["rate"]:
+            regressions.append(
+                "{}: {:.3g} {}/s, baseline {:.3g}".format(
+                    _key(result), result["rate"], result["unit"], reference["rate"]
+                )
+            )
+
+        peak_limit = (1 + tolerance) * max(reference["peak_bytes"], 1024)
+
+        if result["peak_bytes"] > peak_limit:
+            regressions.append(
+                "{}: peak memory {} bytes, baseline {} bytes".format(
+                    _key(result), result["peak_bytes"], reference["peak_bytes"]
+                )
+            )
+
+    return regressions
+
+
+def main(argv=None):
+
+    """Command line entry point of the benchmark suite."""
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="store as the baseline")
+    parser.add_argument("--quick", action="store_true", help="smallest sizes only")
+    parser.add_argument("--only", default=None, help="run names containing this")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--output", default=None, help="also write results here")
+    args = parser.parse_args(argv)
+
+    def print_result(result):
+        print(
+            "{:55s} {:10.3g} {}/s {:8.1f} MiB".format(
+                _key(result),
+                result["rate"],
+                result["unit"],
+                result["peak_bytes"] / 2 ** 20,
+            )
+        )
+
+    results = run_benchmarks(args.quick, args.only, print_result)
+
+    if args.output is not None:
+        save_baseline(results, args.output)
+
+    if args.save:
+        save_baseline(results, args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("no baseline at {}; run with --save".format(args.baseline))
+        return 0
+
+    regressions = compare(results, load_baseline(args.baseline), args.tolerance)
+
+    for message in regressions:
+        print("REGRESSION", message)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
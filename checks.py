@@ -0,0 +1,1344 @@
+""" Randomized equality checks of the fast engines
+
+The vectorized, packed, batch and hashlife engines, cycle skipping and
+checkpointed chains all claim to give exactly the results of a simple
+reference. Each check below runs both on random rules, lattices and
+run lengths, and fails on the first difference:
+
+- three_state: ThreeStateCA (array and list modes, evolve in several
+  calls, detect_cycles, iter_evolve and evolve after it), iter_spacetime and
+  batch_spacetime_fields against a per-cell dict lookup engine;
+- two_state: the packed, batch, streaming and cycle skipping engines
+  against spacetime_field;
+- hashlife: hashlife.advance against the last row of spacetime_field,
+  or of the row it comes back to on runs longer than the orbit;
+- attractor: two_state.attractor against a seen-dict of the rows;
+- rule_tables: the ECA and three state tables against the binary and
+  base 3 strings of the rule numbers, and the bound of the cache;
+- general_ca: GeneralCA and the general_ca streams against two_state,
+  three_state and a per-cell loop, with evolve in several calls;
+- analysis: row_density, block_entropy, row_block_entropy and damage
+  against loops over the rows and windows, for arrays, rows and blocks
+  of any size;
+- resume: a checkpointed chain killed after a checkpoint and resumed
+  against the same chain run without interruption;
+- data_loader: parse_sys with and without the dimension line, and
+  load_data from memory, from the cache directory and after a change;
+- likelihood: Likelihood, likelihood and log_likelihood against the
+  np.linalg.inv formula they replaced;
+- log_prior: log_prior against log(prior), and log_posterior against
+  their sum, without evaluating the likelihood where the prior is 0;
+- store: bit packing round trips, and record_spacetime, fresh or
+  resumed after a crash, against iter_spacetime;
+- render: PNG (chunks, CRCs, palette, scanlines) and PGM files of
+  render and render_stream, decoded, against a block by block
+  downsample;
+- cosmology: distance_modulus against a direct integration, and
+  batch_log_likelihood against log_likelihood one set at a time;
+- posterior_grid: posterior_grid and posterior_quantiles against the
+  Gamma density and closed form CDF of log(a);
+- convergence: metropolis_hastings_until_converged against the first
+  iterations of metropolis_hastings_ensemble, for any check interval.
+
+    python checks.py                     # all checks
+    python checks.py --only hashlife --trials 1000
+"""
+import argparse
+import json
+import math
+import os
+import struct
+import sys
+import tempfile
+import zlib
+import numpy as np
+import analysis
+import bayesian
+import data_loader
+import general_ca
+import hashlife
+import prior_likelihood
+import render
+import rule_tables
+import spacetime_store
+import three_state
+import two_state
+from cosmology import SPEED_OF_LIGHT, distance_modulus, mu_model
+from data_loader import LightCurveData
+
+
+class CheckFailed(AssertionError):
+
+    """Raised by a check whose engines disagree."""
+
+
+def _expect(condition, message, *args):
+
+    if not condition:
+        raise CheckFailed(message.format(*args))
+
+
+def _three_state_reference(rule_number, initial_condition, time_steps):
+
+    """Returns the spacetime field as lists of lists, computed cell by
+    cell from a dict lookup table whose output for the neighborhood
+    (left, self) is the base 3 digit 3*left + self of the rule number.
+    """
+
+    table = {
+        (left, center): rule_number // 3 ** (3 * left + center) % 3
+        for left in range(3)
+        for center in range(3)
+    }
+    field = [list(initial_condition)]
+
+    for _ in range(time_steps):
+        row = field[-1]
+        field.append([table[(row[i - 1], row[i])] for i in range(len(row))])
+
+    return field
+
+
+def check_three_state(rng, trials):
+
+    """ThreeStateCA and the three state streams equal the dict engine."""
+
+    for trial in range(trials):
+        rule_number = int(rng.choice([0, 3 ** 9 - 1, rng.integers(3 ** 9)]))
+        length = int(rng.integers(1, 40))
+        time_steps = int(rng.integers(0, 40))
+        init = rng.integers(0, 3, length).tolist()
+        reference = _three_state_reference(rule_number, init, time_steps)
+        label = "rule {}, N={}, T={}".format(rule_number, length, time_steps)
+
+        ca = three_state.ThreeStateCA(rule_number, init)
+        ca.evolve(time_steps)
+        _expect(ca.spacetime.tolist() == reference, "evolve: {}", label)
+
+        ca = three_state.ThreeStateCA(rule_number, init, as_list=True)
+        ca.evolve(time_steps)
+        _expect(
+            [list(row) for row in ca.spacetime] == reference, "as_list: {}", label
+        )
+
+        # iter_evolve yields the new rows only; several evolve calls,
+        # with and without cycle detection
+
+        ca = three_state.ThreeStateCA(rule_number, init)
+        split = int(rng.integers(0, time_steps + 1))
+        rows = list(ca.iter_evolve(split))
+        _expect(
+            [row.tolist() for row in rows] == reference[1 : split + 1],
+            "iter_evolve: {}",
+            label,
+        )
+
+        # evolve after iter_evolve first appends the configuration the
+        # stream reached, recorded as a gap
+
+        expected = reference[:1] + reference[split:] if split else reference
+        gaps = [1] if split else []
+        for as_list in (False, True):
+            ca = three_state.ThreeStateCA(rule_number, init, as_list=as_list)
+            for _ in ca.iter_evolve(split):
+                pass
+            ca.evolve(time_steps - split)
+            _expect(
+                [list(row) for row in ca.spacetime] == expected and ca.gaps == gaps,
+                "evolve after iter_evolve: {}, as_list={}",
+                label,
+                as_list,
+            )
+        ca = three_state.ThreeStateCA(rule_number, init)
+        ca.evolve(split, detect_cycles=bool(trial % 2))
+        ca.evolve(time_steps - split, detect_cycles=not trial % 2)
+        _expect(ca.spacetime.tolist() == reference, "split evolve: {}", label)
+
+        streamed = np.array(
+            list(three_state.iter_spacetime(rule_number, init, time_steps))
+        )
+        _expect(streamed.tolist() == reference, "iter_spacetime: {}", label)
+
+        batch = three_state.batch_spacetime_fields([rule_number], [init], time_steps)
+        _expect(batch[0, 0].tolist() == reference, "batch: {}", label)
+
+
+def check_two_state(rng, trials):
+
+    """The packed, batch, streaming and cycle skipping ECA engines equal
+    spacetime_field.
+    """
+
+    for _ in range(trials):
+        rule_number = int(rng.integers(256))
+
+        # lengths around multiples of 64 exercise the packed words
+
+        length = int(
+            rng.choice([1, 2, 63, 64, 65, 127, 128, 129, rng.integers(1, 200)])
+        )
+        time_steps = int(rng.integers(0, 60))
+        init = rng.integers(0, 2, length).tolist()
+        reference = two_state.spacetime_field(rule_number, init, time_steps)
+        label = "rule {}, N={}, T={}".format(rule_number, length, time_steps)
+
+        packed = two_state.packed_spacetime_field(
+            rule_number, init, time_steps, unpack=True
+        )
+        _expect(packed.tolist() == reference, "packed: {}", label)
+
+        batch = two_state.batch_spacetime_fields([rule_number], [init], time_steps)
+        _expect(batch[0, 0].tolist() == reference, "batch: {}", label)
+
+        streamed = np.array(
+            list(two_state.iter_spacetime(rule_number, init, time_steps))
+        )
+        _expect(streamed.tolist() == reference, "iter_spacetime: {}", label)
+
+        skipped, transient, period = two_state.spacetime_field(
+            rule_number, init, time_steps, detect_cycles=True, return_cycle=True
+        )
+        _expect(
+            [list(row) for row in skipped] == reference, "detect_cycles: {}", label
+        )
+        _expect(
+            (transient, period)
+            == two_state.attractor(rule_number, init, time_steps),
+            "return_cycle: {}",
+            label,
+        )
+
+
+def check_hashlife(rng, trials):
+
+    """hashlife.advance equals the last row of spacetime_field, with
+    fresh engines and with one engine reused across runs.
+    """
+
+    engines = {}
+
+    for _ in range(trials):
+        rule_number = int(rng.choice([90, 110, 184, rng.integers(256)]))
+        length = int(rng.integers(1, 100))
+        time_steps = int(rng.integers(0, 300))
+        init = rng.integers(0, 2, length).tolist()
+        expected = two_state.spacetime_field(rule_number, init, time_steps)[-1]
+        label = "rule {}, N={}, T={}".format(rule_number, length, time_steps)
+
+        _expect(
+            hashlife.advance(rule_number, init, time_steps) == expected,
+            "advance: {}",
+            label,
+        )
+
+        engine = engines.setdefault(rule_number, hashlife.HashlifeEngine(rule_number))
+        _expect(
+            engine.advance(init, time_steps) == expected, "reused engine: {}", label
+        )
+        _expect(
+            hashlife.HashlifeEngine(rule_number, fallback=False).advance(
+                init, time_steps
+            )
+            == expected,
+            "without fallback: {}",
+            label,
+        )
+
+        # long runs on small lattices, whose orbits are skipped
+
+        length = int(rng.integers(1, 12))
+        time_steps = int(rng.integers(0, 10 ** 9))
+        init = rng.integers(0, 2, length).tolist()
+        transient, period = two_state.attractor(rule_number, init, 2 ** length)
+        if time_steps > transient:
+            reduced = transient + (time_steps - transient) % period
+        else:
+            reduced = time_steps
+        _expect(
+            hashlife.advance(rule_number, init, time_steps)
+            == two_state.spacetime_field(rule_number, init, reduced)[-1],
+            "skipped orbit: rule {}, N={}, T={}",
+            rule_number,
+            length,
+            time_steps,
+        )
+
+
+def check_attractor(rng, trials):
+
+    """two_state.attractor equals the first repeat found by keeping
+    every row in a dict.
+    """
+
+    for _ in range(trials):
+        rule_number = int(rng.integers(256))
+        length = int(rng.integers(1, 16))
+        max_steps = int(rng.integers(0, 200))
+        init = rng.integers(0, 2, length).tolist()
+
+        expected = (None, None)
+        seen = {}
+        for t, row in enumerate(
+            two_state.iter_spacetime(rule_number, init, max_steps)
+        ):
+            if row.tobytes() in seen:
+                expected = seen[row.tobytes()], t - seen[row.tobytes()]
+                break
+            seen[row.tobytes()] = t
+
+        _expect(
+            two_state.attractor(rule_number, init, max_steps) == expected,
+            "attractor: rule {}, init {}, max_steps {}",
+            rule_number,
+            init,
+            max_steps,
+        )
+
+
+class _Killed(Exception):
+
+    """Stands for the death of the process in check_resume."""
+
+
+def check_rule_tables(rng, trials):
+
+    """The registry's tables equal the binary and base 3 strings of the
+    rule numbers, are read-only, and the three state cache stays within
+    its bound.
+    """
+
+    for rule_number in range(256):
+        bits = format(rule_number, "08b")[::-1]
+        table = rule_tables.eca_table(rule_number)
+        _expect(
+            table.tolist() == [int(bit) for bit in bits] and not table.flags.writeable,
+            "eca_table: rule {}",
+            rule_number,
+        )
+        _expect(
+            two_state.lookup_table(rule_number)
+            == {
+                (left, center, right): int(bits[4 * left + 2 * center + right])
+                for left, center, right in two_state.neighborhoods()
+            },
+            "lookup_table: rule {}",
+            rule_number,
+        )
+
+    rule_tables.clear_cache()
+    distinct = set()
+
+    for _ in range(trials):
+        rule_numbers = rng.integers(0, 3 ** 9, int(rng.integers(0, 50)))
+        digits = [np.base_repr(int(rule), 3).zfill(9)[::-1] for rule in rule_numbers]
+
+        for rule, rule_digits in zip(rule_numbers.tolist(), digits):
+            table = rule_tables.three_state_table(rule)
+            _expect(
+                table.tolist() == [int(digit) for digit in rule_digits]
+                and not table.flags.writeable
+                and table is three_state.compile_rule(rule),
+                "three_state_table: rule {}",
+                rule,
+            )
+            distinct.add(rule)
+
+        _expect(
+            rule_tables.three_state_tables(rule_numbers).tolist()
+            == [[int(digit) for digit in rule_digits] for rule_digits in digits],
+            "three_state_tables: rules {}",
+            rule_numbers,
+        )
+        _expect(
+            rule_tables.eca_tables(rule_numbers % 256).tolist()
+            == rule_tables.ECA_TABLES[rule_numbers % 256].tolist(),
+            "eca_tables: rules {}",
+            rule_numbers,
+        )
+
+    info = rule_tables.cache_info()
+    _expect(
+        info.currsize == min(len(distinct), rule_tables.THREE_STATE_CACHE_SIZE),
+        "cache size: {}",
+        info,
+    )
+
+    for bad in (-1, 3 ** 9, 1.0):
+        try:
+            rule_tables.three_state_table(bad)
+        except ValueError:
+            continue
+        raise CheckFailed("three_state_table accepted {!r}".format(bad))
+
+
+def check_general_ca(rng, trials):
+
+    """GeneralCA and the general_ca streams equal two_state and
+    three_state on their rules, and a per-cell loop on random ones.
+    """
+
+    for trial in range(trials):
+        length = int(rng.integers(1, 40))
+        time_steps = int(rng.integers(0, 40))
+
+        if trial % 3 == 0:
+            states, offsets = 2, (-1, 0, 1)
+            rule = int(rng.integers(256))
+            init = rng.integers(0, 2, length).tolist()
+            reference = two_state.spacetime_field(rule, init, time_steps)
+        elif trial % 3 == 1:
+            states, offsets = 3, (-1, 0)
+            rule = int(rng.integers(3 ** 9))
+            init = rng.integers(0, 3, length).tolist()
+            reference = _three_state_reference(rule, init, time_steps)
+        else:
+            states = int(rng.integers(2, 5))
+            offsets = general_ca.symmetric_offsets(int(rng.integers(0, 3)))
+            rule = general_ca.random_rule(states, len(offsets), seed=rng)
+            init = rng.integers(0, states, length).tolist()
+            reference = [init]
+            for _ in range(time_steps):
+                row = reference[-1]
+                new_row = []
+                for x in range(length):
+                    code = 0
+                    for offset in offsets:
+                        code = code * states + row[(x + offset) % length]
+                    new_row.append(int(rule[code]))
+                reference.append(new_row)
+
+        reference = [list(row) for row in reference]
+        label = "k={}, offsets={}, N={}, T={}".format(
+            states, offsets, length, time_steps
+        )
+
+        field = general_ca.spacetime_field(rule, states, offsets, init, time_steps)
+        _expect(field.tolist() == reference, "spacetime_field: {}", label)
+
+        streamed = general_ca.iter_spacetime(rule, states, offsets, init, time_steps)
+        _expect(
+            [row.tolist() for row in streamed] == reference, "iter_spacetime: {}", label
+        )
+
+        # several evolve calls grow the buffer past its capacity
+
+        ca = general_ca.GeneralCA(rule, init, states, offsets)
+        done = 0
+        while done < time_steps:
+            steps = int(rng.integers(0, time_steps - done + 1))
+            ca.evolve(steps)
+            done += steps
+        _expect(ca.spacetime.tolist() == reference, "GeneralCA: {}", label)
+        _expect(
+            general_ca.compile_rule(ca.rule_number(), states, len(offsets)).tolist()
+            == general_ca.compile_rule(rule, states, len(offsets)).tolist(),
+            "rule_number: {}",
+            label,
+        )
+
+
+def _entropy_reference(windows):
+
+    """Returns the Shannon entropy in bits of a list of windows."""
+
+    counts = {}
+    for window in windows:
+        counts[window] = counts.get(window, 0) + 1
+
+    return sum(
+        count / len(windows) * math.log2(len(windows) / count)
+        for count in counts.values()
+    )
+
+
+def check_analysis(rng, trials):
+
+    """row_density, the block entropies and damage equal loops over the
+    rows and windows of the field, whether it is read as an array, as
+    rows or as blocks of any size.
+    """
+
+    for _ in range(trials):
+        states = int(rng.integers(2, 5))
+        height = int(rng.integers(1, 40))
+        length = int(rng.integers(1, 30))
+        block_length = int(rng.integers(1, 5))
+        block_size = int(rng.integers(1, 20))
+        field = rng.integers(0, states, (height, length)).astype(np.uint8)
+        changed = rng.random((height, length)) < rng.random()
+        perturbed = np.where(changed, (field + 1) % states, field).astype(np.uint8)
+        site = int(rng.integers(length))
+        label = "{}x{}, k={}, n={}, block_size={}".format(
+            height, length, states, block_length, block_size
+        )
+
+        windows = [
+            [
+                tuple(row[(x + i) % length] for i in range(block_length))
+                for x in range(length)
+            ]
+            for row in field.tolist()
+        ]
+        density = [
+            [row.count(state) / length for state in range(states)]
+            for row in field.tolist()
+        ]
+        hamming, left, right = [], [], []
+        for row, perturbed_row in zip(field, perturbed):
+            offsets = [
+                (x - site + length // 2) % length - length // 2
+                for x in range(length)
+                if row[x] != perturbed_row[x]
+            ]
+            hamming.append(len(offsets))
+            left.append(min(offsets, default=np.nan))
+            right.append(max(offsets, default=np.nan))
+
+        def sources(values):
+            cuts = np.sort(rng.integers(0, height + 1, int(rng.integers(0, 5))))
+            return {
+                "array": values,
+                "rows": iter(values),
+                "blocks": iter(np.split(values, cuts)),
+            }
+
+        for kind, source in sources(field).items():
+            _expect(
+                np.allclose(analysis.row_density(source, states, block_size), density),
+                "row_density: {}, {}",
+                label,
+                kind,
+            )
+
+        for kind, source in sources(field).items():
+            _expect(
+                np.allclose(
+                    analysis.row_block_entropy(
+                        source, block_length, states, block_size
+                    ),
+                    [_entropy_reference(row_windows) for row_windows in windows],
+                ),
+                "row_block_entropy: {}, {}",
+                label,
+                kind,
+            )
+
+        for kind, source in sources(field).items():
+            _expect(
+                _close(
+                    analysis.block_entropy(source, block_length, states, block_size),
+                    _entropy_reference(sum(windows, [])),
+                ),
+                "block_entropy: {}, {}",
+                label,
+                kind,
+            )
+
+        for kind, source in sources(field).items():
+            result = analysis.damage(source, sources(perturbed)[kind], site, block_size)
+            _expect(
+                result["hamming"].tolist() == hamming
+                and np.array_equal(result["left"], left, equal_nan=True)
+                and np.array_equal(result["right"], right, equal_nan=True),
+                "damage: {}, {}",
+                label,
+                kind,
+            )
+
+    # a damage growing as e^{t/2} with edges at -t and 2t
+
+    times = np.arange(20)
+    rates = analysis.spreading_rates(
+        {"hamming": np.exp(times / 2), "left": -times, "right": 2 * times}
+    )
+    _expect(
+        _close(rates["lyapunov"], 0.5)
+        and _close(rates["left_speed"], -1)
+        and _close(rates["right_speed"], 2),
+        "spreading_rates: {}",
+        rates,
+    )
+
+
+def check_resume(rng, trials):
+
+    """A checkpointed chain killed after any checkpoint and resumed
+    equals, bit for bit, the same chain run without interruption, and
+    with the default chunk size equals metropolis_hastings.
+    """
+
+    write_checkpoint = bayesian._write_checkpoint
+
+    with tempfile.TemporaryDirectory() as directory:
+        for trial in range(trials):
+            iterations = int(rng.integers(1, 5000))
+            chunk_size = int(rng.integers(max(iterations // 20, 1), iterations + 1))
+            seed = int(rng.integers(2 ** 32))
+            data = rng.standard_normal(int(rng.integers(1, 200)))
+            label = "iterations {}, chunk_size {}, seed {}".format(
+                iterations, chunk_size, seed
+            )
+
+            path = os.path.join(directory, "straight{}.npy".format(trial))
+            straight = np.array(
+                bayesian.metropolis_hastings_checkpointed(
+                    iterations, 10, data, path, seed, chunk_size
+                )
+            )
+
+            # the chain dies right after one of its checkpoints, the
+            # first being written before any sample
+
+            writes = [0]
+            kill_after = int(rng.integers(1, -(-iterations // chunk_size) + 1))
+
+            def dying_write(path, checkpoint):
+                write_checkpoint(path, checkpoint)
+                writes[0] += 1
+                if writes[0] == kill_after:
+                    raise _Killed()
+
+            path = os.path.join(directory, "resumed{}.npy".format(trial))
+            bayesian._write_checkpoint = dying_write
+            try:
+                bayesian.metropolis_hastings_checkpointed(
+                    iterations, 10, data, path, seed, chunk_size
+                )
+            except _Killed:
+                pass
+            finally:
+                bayesian._write_checkpoint = write_checkpoint
+
+            resumed = np.array(bayesian.resume_metropolis_hastings(path))
+            _expect(
+                resumed.tobytes() == straight.tobytes(), "resume: {}", label
+            )
+
+        iterations = bayesian.BLOCK_SIZE + 1000
+        path = os.path.join(directory, "default.npy")
+        _expect(
+            np.array(
+                bayesian.metropolis_hastings_checkpointed(
+                    iterations, 10, data, path, seed
+                )
+            ).tobytes()
+            == bayesian.metropolis_hastings(iterations, 10, data, seed).tobytes(),
+            "checkpointed against metropolis_hastings: seed {}",
+            seed,
+        )
+
+
+def _light_curve_data(rng, size):
+
+    """Returns random light curve data of the given size and a random
+    systematic error matrix.
+    """
+
+    redshift = np.sort(rng.uniform(0.01, 2, size))
+    factor = rng.normal(0, 0.05, (size, size))
+    data = LightCurveData(
+        {
+            "zcmb": redshift,
+            "mb": rng.normal(24, 2, size),
+            "dmb": rng.uniform(0.05, 0.2, size),
+        }
+    )
+
+    return data, factor @ factor.T
+
+
+def _close(value, reference, tolerance=1e-9):
+
+    return abs(value - reference) <= tolerance * max(abs(reference), 1)
+
+
+def _write_data_files(directory, rng, size, header):
+
+    """Writes random lcparam and sys files and returns their paths and
+    contents.
+    """
+
+    columns = {
+        "zcmb": np.sort(rng.uniform(0.01, 2, size)),
+        "mb": rng.normal(24, 2, size),
+        "dmb": rng.uniform(0.05, 0.2, size),
+    }
+    sys_error = rng.normal(0, 0.01, (size, size))
+    lcparam_path = os.path.join(directory, "lcparam.txt")
+    sys_path = os.path.join(directory, "sys.txt")
+
+    with open(lcparam_path, "w") as lc_file:
+        lc_file.write("#name " + " ".join(columns) + "\n")
+        for index in range(size):
+            values = " ".join(repr(float(columns[name][index])) for name in columns)
+            lc_file.write("sn{} {}\n".format(index, values))
+
+    with open(sys_path, "w") as sys_file:
+        if header:
+            sys_file.write("{}\n".format(size))
+        sys_file.writelines(repr(float(value)) + "\n" for value in sys_error.ravel())
+
+    return lcparam_path, sys_path, columns, sys_error
+
+
+def check_data_loader(rng, trials):
+
+    """parse_sys infers the dimension with or without a header line, and
+    load_data returns the parsed files, from memory, from the cache
+    directory and again after a file changes.
+    """
+
+    # a single value is a 1x1 matrix even if it could be the header n=0
+
+    with tempfile.TemporaryDirectory() as directory:
+        sys_path = os.path.join(directory, "sys.txt")
+        with open(sys_path, "w") as sys_file:
+            sys_file.write("0\n")
+        _expect(
+            data_loader.parse_sys(sys_path).tolist() == [[0.0]], "parse_sys: 1x1 zero"
+        )
+
+    for trial in range(trials):
+        size = int(rng.choice([1, 2, 40, rng.integers(1, 60)]))
+        header = bool(trial % 2)
+        label = "n={}, header={}".format(size, header)
+
+        with tempfile.TemporaryDirectory() as directory:
+            lcparam_path, sys_path, columns, sys_error = _write_data_files(
+                directory, rng, size, header
+            )
+            cache_dir = os.path.join(directory, "cache")
+
+            _expect(
+                data_loader.parse_sys(sys_path).tolist() == sys_error.tolist(),
+                "parse_sys: {}",
+                label,
+            )
+
+            loaded = data_loader.load_data(lcparam_path, sys_path, cache_dir)
+            data, sys_loaded = loaded
+            _expect(
+                sorted(data.columns) == sorted(columns)
+                and all(
+                    getattr(data, name).tolist() == column.tolist()
+                    for name, column in columns.items()
+                )
+                and len(data) == size
+                and sys_loaded.tolist() == sys_error.tolist(),
+                "load_data: {}",
+                label,
+            )
+            _expect(
+                not sys_loaded.flags.writeable and not data.mb.flags.writeable,
+                "read-only arrays: {}",
+                label,
+            )
+            _expect(
+                data_loader.load_data(lcparam_path, sys_path, cache_dir) is loaded,
+                "in-process cache: {}",
+                label,
+            )
+
+            # another process finds the entry in the cache directory
+
+            data_loader._LOADED.clear()
+            data, sys_loaded = data_loader.load_data(lcparam_path, sys_path, cache_dir)
+            _expect(
+                isinstance(sys_loaded, np.memmap)
+                and sys_loaded.tolist() == sys_error.tolist()
+                and data.zcmb.tolist() == columns["zcmb"].tolist(),
+                "cache directory: {}",
+                label,
+            )
+
+            # a changed file is parsed again
+
+            _, _, columns, sys_error = _write_data_files(
+                directory, rng, size + 1, header
+            )
+            data, sys_loaded = data_loader.load_data(lcparam_path, sys_path, cache_dir)
+            _expect(
+                sys_loaded.tolist() == sys_error.tolist()
+                and data.mb.tolist() == columns["mb"].tolist()
+                and len(os.listdir(cache_dir)) == 2,
+                "changed file: {}",
+                label,
+            )
+
+
+def check_likelihood(rng, trials):
+
+    """The cached likelihood equals exp(-r^T C^-1 r / 2) computed with
+    np.linalg.inv, whatever the number of evaluations.
+    """
+
+    for _ in range(trials):
+        size = int(rng.choice([1, 2, 40, 65, 130, rng.integers(1, 300)]))
+        data, sys_error = _light_curve_data(rng, size)
+        include_sys_error = rng.choice([True, "True", False, "False"])
+        params = [rng.uniform(0, 1), rng.uniform(0, 1), rng.uniform(50, 90), -19.3]
+        label = "n={}, include_sys_error={}".format(size, include_sys_error)
+
+        cov_matrix = np.diag(data.dmb ** 2)
+        if include_sys_error not in ("False", False):
+            cov_matrix = cov_matrix + sys_error
+        residual = data.mb - (mu_model(params, data) - params[3])
+        chi2 = residual @ np.linalg.inv(cov_matrix) @ residual
+
+        cached = prior_likelihood.Likelihood(data, sys_error, include_sys_error)
+        values = [cached.log_likelihood(params, mu_model) for _ in range(3)]
+        _expect(_close(values[0], -0.5 * chi2), "Likelihood: {}", label)
+        _expect(len(set(values)) == 1, "repeated evaluations: {}", label)
+        _expect(
+            values[0]
+            == prior_likelihood.log_likelihood(
+                params, mu_model, data, sys_error, include_sys_error
+            ),
+            "log_likelihood: {}",
+            label,
+        )
+        _expect(
+            _close(
+                prior_likelihood.likelihood(
+                    params, mu_model, data, sys_error, include_sys_error
+                ),
+                np.exp(-0.5 * chi2),
+            ),
+            "likelihood: {}",
+            label,
+        )
+        _expect(
+            np.allclose(
+                cached.whitening @ cached.cholesky, np.eye(size), atol=1e-9
+            ),
+            "inverse_lower_triangular: {}",
+            label,
+        )
+
+
+class _ForbiddenLikelihood:
+
+    """Stands in for a Likelihood that must not be evaluated."""
+
+    def log_likelihood(self, params, mu_model):
+        raise CheckFailed("likelihood evaluated in the forbidden region")
+
+
+def check_log_prior(rng, trials):
+
+    """log_prior equals log(prior), and log_posterior adds log_prior and
+    the log likelihood, skipping the likelihood where the prior is 0.
+    """
+
+    data, sys_error = _light_curve_data(rng, 20)
+    cached = prior_likelihood.Likelihood(data, sys_error, True)
+
+    for trial in range(trials):
+        magnitude_mode = ("uniform", "gaussian")[trial % 2]
+
+        # each of omega_m, omega_h and H_0 is negative a third of the time
+
+        params = [
+            rng.uniform(-0.5, 1),
+            rng.uniform(-0.5, 1),
+            rng.uniform(-40, 80),
+            rng.normal(19.23, 0.3),
+        ]
+        label = "params={}, {}".format(params, magnitude_mode)
+        value = prior_likelihood.log_prior(params, magnitude_mode)
+        prior = prior_likelihood.prior(params, magnitude_mode)
+
+        if min(params[:3]) < 0:
+            _expect(value == -np.inf and prior == 0, "forbidden log_prior: {}", label)
+            _expect(
+                prior_likelihood.log_posterior(
+                    params, magnitude_mode, mu_model, _ForbiddenLikelihood()
+                )
+                == -np.inf,
+                "forbidden log_posterior: {}",
+                label,
+            )
+            continue
+
+        _expect(_close(value, np.log(prior)), "log_prior: {}", label)
+        _expect(
+            prior_likelihood.log_posterior(params, magnitude_mode, mu_model, cached)
+            == value + cached.log_likelihood(params, mu_model),
+            "log_posterior: {}",
+            label,
+        )
+
+
+def check_cosmology(rng, trials):
+
+    """distance_modulus equals the luminosity distance integrated
+    directly, for K parameter sets at once, and batch_log_likelihood
+    equals log_likelihood with mu_model one parameter set at a time.
+    Data without redshifts still works with another mu_model.
+    """
+
+    for _ in range(trials):
+        size = int(rng.integers(1, 60))
+        data, sys_error = _light_curve_data(rng, size)
+        params = np.column_stack(
+            [
+                rng.uniform(0, 1, 4),
+                rng.uniform(0, 1, 4),
+                rng.uniform(50, 90, 4),
+                rng.uniform(-20, -19, 4),
+            ]
+        )
+        label = "n={}".format(size)
+
+        batch = distance_modulus(params, data.zcmb)
+        for k, param_set in enumerate(params):
+
+            # trapezoid rule on a fine grid of its own for every redshift
+
+            omega_m, omega_lambda, hubble = param_set[:3]
+            curvature = 1 - omega_m - omega_lambda
+            z = data.zcmb[:, None] * np.linspace(0, 1, 4001)
+            inverse_e = 1 / np.sqrt(
+                omega_m * (1 + z) ** 3 + curvature * (1 + z) ** 2 + omega_lambda
+            )
+            integral = np.sum(
+                (inverse_e[:, 1:] + inverse_e[:, :-1]) * np.diff(z, axis=1) / 2, axis=1
+            )
+            root = np.sqrt(abs(curvature))
+            if curvature > 0:
+                integral = np.sinh(root * integral) / root
+            elif curvature < 0:
+                integral = np.sin(root * integral) / root
+            distance = (1 + data.zcmb) * SPEED_OF_LIGHT / hubble * integral
+            expected = 5 * np.log10(distance) + 25
+
+            _expect(
+                np.allclose(batch[k], expected, rtol=0, atol=1e-4),
+                "distance_modulus: {}, params {}",
+                label,
+                param_set,
+            )
+            _expect(
+                np.array_equal(distance_modulus(param_set, data.zcmb), batch[k]),
+                "single parameter set: {}",
+                label,
+            )
+
+        cached = prior_likelihood.Likelihood(data, sys_error, True)
+        _expect(
+            np.allclose(
+                cached.batch_log_likelihood(params),
+                [cached.log_likelihood(p, mu_model) for p in params],
+                rtol=1e-9,
+                atol=0,
+            ),
+            "batch_log_likelihood: {}",
+            label,
+        )
+
+        # a caller-supplied model of data without a zcmb column
+
+        columns = {"mb": data.mb, "dmb": data.dmb, "distance": data.zcmb}
+        _expect(
+            np.isfinite(
+                prior_likelihood.log_likelihood(
+                    params[0],
+                    lambda p, d: 5 * np.log10(d.distance) + 40,
+                    LightCurveData(columns),
+                    sys_error,
+                    True,
+                )
+            ),
+            "mu_model without zcmb: {}",
+            label,
+        )
+
+
+def _gamma_cdf(shape, x):
+
+    """Returns the CDF at x of the Gamma distribution of integer shape k
+    and rate 1, 1 - e^{-x} sum_{j<k} x^j/j!, summed in log space.
+    """
+
+    j = np.arange(shape)
+    log_terms = -x[:, None] + j * np.log(x[:, None]) - [math.lgamma(i + 1) for i in j]
+
+    return 1 - np.exp(log_terms).sum(axis=1)
+
+
+def check_posterior_grid(rng, trials):
+
+    """posterior_grid is the density of a whose log is Gamma distributed
+    (see default_grid), its CDF integrates it, and posterior_quantiles
+    inverts it, against the closed form CDF for even numbers of points.
+    """
+
+    trials = max(trials // 10, 1)  # a million-point grid per trial
+
+    for _ in range(trials):
+        length = 2 * int(rng.integers(1, 1000))
+        data = rng.normal(0, 1, length)
+        sq_sum_data = float(sum(x * x for x in data))
+        label = "n={}".format(length)
+
+        statistics = bayesian.sufficient_statistics(data)
+        _expect(
+            _close(statistics[0], sq_sum_data) and statistics[1] == length,
+            "sufficient_statistics: {}",
+            label,
+        )
+
+        shape, rate = length / 2 + 1, sq_sum_data / 2 - 1
+        if rate <= 0:
+            try:
+                bayesian.posterior_grid(data)
+            except ValueError:
+                continue
+            raise CheckFailed("not normalizable, no ValueError: " + label)
+
+        grid = bayesian.posterior_grid(data)
+        a_values, density, cdf = grid["a"], grid["density"], grid["cdf"]
+        _expect(
+            cdf[0] == 0 and _close(cdf[-1], 1) and (np.diff(cdf) >= 0).all(),
+            "cdf: {}",
+            label,
+        )
+
+        # the density of a is the Gamma density of u = log(a) over a
+
+        points = a_values[1 :: len(a_values) // 50]
+        log_a = np.log(points)
+        exact = np.exp(
+            shape * math.log(rate)
+            - math.lgamma(shape)
+            + (shape - 1) * np.log(log_a)
+            - rate * log_a
+        ) / points
+        index = np.searchsorted(a_values, points)
+        _expect(
+            np.allclose(density[index], exact, rtol=1e-6, atol=1e-9 * exact.max()),
+            "density: {}",
+            label,
+        )
+        _expect(
+            np.allclose(cdf[index], _gamma_cdf(int(shape), rate * log_a), atol=1e-7),
+            "cdf against the closed form: {}",
+            label,
+        )
+
+        probabilities = np.array([0.001, 0.025, 0.5, 0.975, 0.999])
+        quantiles = bayesian.posterior_quantiles(data, probabilities, grid)
+        _expect(
+            np.allclose(
+                _gamma_cdf(int(shape), rate * np.log(quantiles)),
+                probabilities,
+                atol=1e-7,
+            ),
+            "posterior_quantiles: {}",
+            label,
+        )
+
+        # grid points with a <= 1 have no posterior mass
+
+        a_values = np.linspace(0.5, float(points[-1]), 1001)
+        density = bayesian.posterior_grid(data, a_values)["density"]
+        _expect(not density[a_values <= 1].any(), "density below a=1: {}", label)
+
+
+def check_convergence(rng, trials):
+
+    """Chains run until converged equal the first iterations of the
+    ensemble with the same seed, whatever the check interval, and stop
+    at a check.
+    """
+
+    trials = max(1, trials // 10)
+
+    for _ in range(trials):
+        chains = int(rng.integers(2, 6))
+        seed = int(rng.integers(2 ** 32))
+        data = rng.standard_normal(int(rng.integers(1, 100)))
+        ensemble = bayesian.metropolis_hastings_ensemble(
+            5000, 10, data, chains=chains, seed=seed
+        )
+
+        for check_every in rng.integers(1, 3000, 3).tolist():
+            label = "chains {}, seed {}, check_every {}".format(
+                chains, seed, check_every
+            )
+            samples, diagnostics = bayesian.metropolis_hastings_until_converged(
+                10,
+                data,
+                chains=chains,
+                target_ess=float(rng.uniform(10, 500)),
+                max_rhat=1.1,
+                max_iterations=5000,
+                check_every=check_every,
+                seed=seed,
+            )
+            iterations = diagnostics["iterations"]
+            _expect(
+                np.array_equal(samples, ensemble[:, :iterations]),
+                "samples: {}",
+                label,
+            )
+            _expect(
+                iterations % check_every == 0 or iterations == 5000,
+                "stopped between checks: {}",
+                label,
+            )
+
+    try:
+        bayesian.metropolis_hastings_until_converged(10, data, chains=1, max_rhat=1.1)
+    except ValueError:
+        pass
+    else:
+        raise CheckFailed("max_rhat with one chain")
+
+
+def check_store(rng, trials):
+
+    """Stores unpack to the rows packed into them, and a recorded run,
+    fresh or resumed after a crash at any row, equals the field of
+    iter_spacetime.
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        for trial in range(trials):
+            module, states = [(two_state, 2), (three_state, 3)][trial % 2]
+            rule_number = int(rng.integers(256 if states == 2 else 3 ** 9))
+            length = int(rng.integers(1, 70))
+            time_steps = int(rng.integers(0, 200))
+            block_size = int(rng.integers(1, 64))
+            init = rng.integers(0, states, length).tolist()
+            label = "states {}, rule {}, N={}, T={}".format(
+                states, rule_number, length, time_steps
+            )
+
+            rows = rng.integers(0, states, (5, length)).astype(np.uint8)
+            _expect(
+                np.array_equal(
+                    spacetime_store.unpack_rows(
+                        spacetime_store.pack_rows(rows, states), length, states
+                    ),
+                    rows,
+                ),
+                "pack_rows: {}",
+                label,
+            )
+
+            expected = np.array(
+                list(module.iter_spacetime(rule_number, init, time_steps))
+            )
+            path = os.path.join(directory, "field{}.npy".format(trial))
+            store = module.record_spacetime(
+                path, rule_number, init, time_steps, block_size
+            )
+            _expect(np.array_equal(store[:], expected), "record: {}", label)
+
+            # a crash after `kept` rows: the rows after them are garbage
+            # and the metadata does not count them
+
+            kept = int(rng.integers(1, time_steps + 2))
+            packed = np.load(path, mmap_mode="r+")
+            packed[kept:] = 0xFF
+            packed.flush()
+            del packed, store
+            with open(path + ".json") as meta_file:
+                meta = json.load(meta_file)
+            meta["rows"] = kept
+            with open(path + ".json", "w") as meta_file:
+                json.dump(meta, meta_file)
+
+            store = module.record_spacetime(
+                path, rule_number, init, time_steps, block_size
+            )
+            _expect(np.array_equal(store[:], expected), "resume: {}", label)
+
+            other = list(init)
+            other[0] = (other[0] + 1) % states
+            try:
+                module.record_spacetime(path, rule_number, other, time_steps)
+            except ValueError:
+                pass
+            else:
+                raise CheckFailed("other initial condition: {}".format(label))
+
+
+# The checks: name and function taking a random generator and a number
+# of trials.
+
+def _read_png(path):
+
+    """Decodes a palette PNG with filter type 0 scanlines, checking the
+    chunk CRCs, and returns its palette and (H, W) pixel indices.
+    """
+
+    with open(path, "rb") as png_file:
+        data = png_file.read()
+
+    _expect(data[:8] == render.PNG_SIGNATURE, "PNG signature: {}", path)
+    position = 8
+    chunks = []
+
+    while position < len(data):
+        (size,) = struct.unpack(">I", data[position : position + 4])
+        kind = data[position + 4 : position + 8]
+        body = data[position + 8 : position + 8 + size]
+        (crc,) = struct.unpack(">I", data[position + 8 + size : position + 12 + size])
+        _expect(crc == zlib.crc32(kind + body) & 0xFFFFFFFF, "PNG CRC: {}", kind)
+        chunks.append((kind, body))
+        position += 12 + size
+
+    _expect(
+        [kind for kind, _ in chunks[:2]] == [b"IHDR", b"PLTE"]
+        and chunks[-1] == (b"IEND", b""),
+        "PNG chunk order: {}",
+        [kind for kind, _ in chunks],
+    )
+    width, height, depth, colour_type = struct.unpack(">IIBB", chunks[0][1][:10])
+    _expect((depth, colour_type) == (8, 3), "PNG 8-bit palette: {}", path)
+
+    palette = np.frombuffer(chunks[1][1], dtype=np.uint8).reshape(-1, 3)
+    pixels = np.frombuffer(
+        zlib.decompress(b"".join(body for kind, body in chunks if kind == b"IDAT")),
+        dtype=np.uint8,
+    ).reshape(height, width + 1)
+    _expect(not pixels[:, 0].any(), "PNG filter types: {}", path)
+
+    return palette, pixels[:, 1:]
+
+
+def _read_pgm(path):
+
+    """Decodes a binary PGM and returns its (H, W) grey levels."""
+
+    with open(path, "rb") as pgm_file:
+        magic = pgm_file.readline()
+        width, height = map(int, pgm_file.readline().split())
+        maximum = int(pgm_file.readline())
+        pixels = pgm_file.read()
+
+    _expect(magic == b"P5\n" and maximum == 255, "PGM header: {}", path)
+
+    return np.frombuffer(pixels, dtype=np.uint8).reshape(height, width)
+
+
+def _downsample_reference(field, factor, states, mode):
+
+    """Downsamples a field block by block with bincount and mean."""
+
+    height, length = field.shape
+    out = np.empty((-(-height // factor), -(-length // factor)), dtype=np.uint8)
+
+    for i in range(out.shape[0]):
+        for j in range(out.shape[1]):
+            block = field[i * factor : (i + 1) * factor, j * factor : (j + 1) * factor]
+            if mode == "majority":
+                out[i, j] = np.bincount(block.ravel(), minlength=states).argmax()
+            else:
+                out[i, j] = round(block.mean() * 255 / (states - 1))
+
+    return out
+
+
+def check_render(rng, trials):
+
+    """PNG and PGM files written by render and render_stream decode to
+    the palette of the downsampled field, for any slab boundaries.
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        for trial in range(trials):
+            states = int(rng.integers(2, 5))
+            height = int(rng.integers(1, 70))
+            length = int(rng.integers(1, 70))
+            factor = int(rng.choice([1, 2, 3, rng.integers(1, 12)]))
+            mode = ("majority", "density")[trial % 2]
+            field = rng.integers(0, states, (height, length)).astype(np.uint8)
+            label = "{}x{}, k={}, factor={}, {}".format(
+                height, length, states, factor, mode
+            )
+
+            expected = _downsample_reference(field, factor, states, mode)
+            _expect(
+                render.downsample(field, factor, states, mode).tolist()
+                == expected.tolist(),
+                "downsample: {}",
+                label,
+            )
+            levels = render.greys(256 if mode == "density" else states)
+
+            png_path = os.path.join(directory, "field.png")
+            render.render(field, png_path, states, factor, mode=mode)
+            palette, pixels = _read_png(png_path)
+            _expect(
+                pixels.tolist() == expected.tolist()
+                and palette.tolist() == np.stack([levels] * 3, 1).tolist(),
+                "render png: {}",
+                label,
+            )
+
+            # blocks of random sizes cut the rows at arbitrary places
+
+            cuts = np.sort(rng.integers(0, height + 1, int(rng.integers(0, 6))))
+            pgm_path = os.path.join(directory, "field.pgm")
+            render.render_stream(
+                np.split(field, cuts), pgm_path, length, height, states, factor, mode
+            )
+            _expect(
+                _read_pgm(pgm_path).tolist() == levels[expected].tolist(),
+                "render_stream pgm: {}",
+                label,
+            )
+
+
+CHECKS = [
+    ("three_state", check_three_state),
+    ("two_state", check_two_state),
+    ("hashlife", check_hashlife),
+    ("attractor", check_attractor),
+    ("rule_tables", check_rule_tables),
+    ("general_ca", check_general_ca),
+    ("analysis", check_analysis),
+    ("resume", check_resume),
+    ("data_loader", check_data_loader),
+    ("likelihood", check_likelihood),
+    ("log_prior", check_log_prior),
+    ("store", check_store),
+    ("render", check_render),
+    ("cosmology", check_cosmology),
+    ("posterior_grid", check_posterior_grid),
+    ("convergence", check_convergence),
+]
+
+
+def main(argv=None):
+
+    """Command line entry point of the checks."""
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--trials", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", default=None, help="run names containing this")
+    args = parser.parse_args(argv)
+
+    failures = 0
+
+    for name, check in CHECKS:
+        if args.only is not None and args.only not in name:
+            continue
+
+        try:
+            check(np.random.default_rng(args.seed), args.trials)
+        except CheckFailed as error:
+            print("FAIL", name, error)
+            failures += 1
+        else:
+            print("ok  ", name)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
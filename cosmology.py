@@ -0,0 +1,113 @@
+""" Vectorized distance modulus model.
+
+This file contains a built-in model of the distance modulus mu of a
+supernova at redshift z in a Friedmann-Lemaitre universe with matter
+density omega_m, dark energy density omega_lambda and Hubble constant
+H_0. Any number K of parameter sets is evaluated at once:
+
+mu = 5 log10(d_L / Mpc) + 25
+d_L = (1 + z) c/H_0 S_k(D(z))
+D(z) = integral of dz'/E(z') from 0 to z
+E(z) = sqrt[omega_m (1+z)^3 + omega_k (1+z)^2 + omega_lambda]
+
+where omega_k = 1 - omega_m - omega_lambda and S_k is sinh, sin or
+the identity for open, closed and flat universes. The integral is
+computed once per parameter set on a fixed redshift grid with the
+cumulative trapezoid rule and interpolated at every redshift.
+"""
+
+import numpy as np
+
+# Speed of light in km/s, so that c/H_0 is in Mpc for H_0 in km/s/Mpc.
+
+SPEED_OF_LIGHT = 299792.458
+
+
+def comoving_integral(omega_m, omega_lambda, redshift, grid_size=2048):
+
+    """ This function calculates D(z) for K parameter sets.
+
+    Parameter:
+    1. omega_m, omega_lambda - Arrays of shape (K, 1).
+    2. redshift - Array of the n redshifts.
+    3. grid_size - Number of points of the redshift grid.
+
+    Returns an array of shape (K, n). Parameter sets for which E(z)^2
+    becomes negative below the largest redshift give nan.
+    """
+
+    z_grid = np.linspace(0, max(np.max(redshift), 1e-8), grid_size)
+    one_plus_z = 1 + z_grid
+
+    e_squared = (
+        omega_m * one_plus_z ** 3
+        + (1 - omega_m - omega_lambda) * one_plus_z ** 2
+        + omega_lambda
+    )
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        inverse_e = np.where(e_squared > 0, 1 / np.sqrt(e_squared), np.nan)
+
+    # cumulative trapezoid rule along the grid, starting at D(0) = 0
+
+    cumulative = np.zeros(inverse_e.shape)
+    cumulative[:, 1:] = np.cumsum(
+        (inverse_e[:, 1:] + inverse_e[:, :-1]) * np.diff(z_grid) / 2, axis=1
+    )
+
+    # linear interpolation weights are shared by all parameter sets
+
+    upper = np.clip(np.searchsorted(z_grid, redshift), 1, grid_size - 1)
+    weight = (redshift - z_grid[upper - 1]) / (z_grid[upper] - z_grid[upper - 1])
+
+    return cumulative[:, upper - 1] * (1 - weight) + cumulative[:, upper] * weight
+
+
+def distance_modulus(params, redshift, grid_size=2048):
+
+    """ This function calculates the distance modulus.
+
+    Parameter:
+    1. params - Array of shape (K, 4) of parameter sets (omega_m,
+    omega_lambda, H_0, M), or a single list of the 4 parameters. M is
+    not used here.
+    2. redshift - Array of the n redshifts.
+    3. grid_size - Number of points of the redshift grid.
+
+    Returns an array of shape (K, n), or (n,) for a single parameter
+    set.
+    """
+
+    params = np.asarray(params, dtype=float)
+    redshift = np.asarray(redshift, dtype=float)
+    batch = np.atleast_2d(params)
+
+    omega_m = batch[:, 0:1]
+    omega_lambda = batch[:, 1:2]
+    hubble = batch[:, 2:3]
+
+    integral = comoving_integral(omega_m, omega_lambda, redshift, grid_size)
+
+    curvature = 1 - omega_m - omega_lambda
+    root = np.sqrt(np.abs(curvature))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        transverse = np.where(
+            curvature > 0,
+            np.sinh(root * integral) / root,
+            np.where(curvature < 0, np.sin(root * integral) / root, integral),
+        )
+        lum_distance = (1 + redshift) * SPEED_OF_LIGHT / hubble * transverse
+        mu = 5 * np.log10(lum_distance) + 25
+
+    return mu if params.ndim == 2 else mu[0]
+
+
+def mu_model(params, data_lcparam):
+
+    """ The built-in mu_model(params, data_lcparam) for likelihood.
+
+    Returns the distance modulus at the redshifts zcmb of the data.
+    """
+
+    return distance_modulus(params, np.asarray(data_lcparam.zcmb, dtype=float))
@@ -0,0 +1,186 @@
+""" Fast, cached loading of the supernova data files.
+
+This file parses the light curve parameter file (e.g.
+lcparam_DS17f.txt) and the systematic error file (e.g. sys_DS17f.txt)
+once and caches the result as .npy files in a directory named after
+the SHA-256 hash of the two files. Later loads, including those of
+other processes, memory-map the cached arrays read-only instead of
+parsing the text again, so the operating system shares a single copy
+of the data between all worker processes. Within a process, loaded
+arrays are also kept in memory, and forked workers inherit them
+without any copy.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+
+# Arrays already loaded in this process, keyed by the path, size and
+# modification time of both files.
+
+_LOADED = {}
+
+
+class LightCurveData:
+
+    """ Columns of a light curve parameter file.
+
+    The columns are read-only numpy arrays available as attributes
+    (data.zcmb, data.mb, data.dmb, ...), like the columns of the pandas
+    DataFrame read from the same file, so a LightCurveData can be
+    passed as data_lcparam to the functions of prior_likelihood.
+    """
+
+    def __init__(self, columns):
+
+        self.columns = columns
+
+    def __getattr__(self, name):
+
+        try:
+            return self.__dict__["columns"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __len__(self):
+
+        return len(next(iter(self.columns.values()), ()))
+
+
+def parse_lcparam(path):
+
+    """ This function parses a light curve parameter file.
+
+    The first line holds the space separated column names (the first
+    one starting with '#'). Columns that do not hold numbers, like the
+    supernova names, are skipped.
+
+    Returns a dictionary that maps column names to float arrays.
+    """
+
+    with open(path) as lc_file:
+        names = lc_file.readline().lstrip("#").split()
+        rows = [line.split() for line in lc_file if line.strip()]
+
+    columns = {}
+
+    for index, name in enumerate(names):
+        try:
+            columns[name] = np.array([float(row[index]) for row in rows])
+        except ValueError:
+            pass
+
+    return columns
+
+
+def parse_sys(path):
+
+    """ This function parses a systematic error file.
+
+    The file holds the n^2 entries of the nxn systematic covariance
+    matrix, one per line, optionally preceded by a line holding n. The
+    dimension n is inferred from the file instead of assumed.
+
+    Returns the nxn matrix.
+    """
+
+    values = np.loadtxt(path, ndmin=1)
+
+    # a leading line holding the dimension n is dropped; a single value
+    # is a 1x1 matrix, not the header of an empty one
+
+    if len(values) > 1 and len(values) - 1 == values[0] ** 2:
+        values = values[1:]
+
+    dimension = int(round(np.sqrt(len(values))))
+
+    if dimension ** 2 != len(values):
+        raise ValueError("the systematic error file does not hold a square matrix")
+
+    return values.reshape(dimension, dimension)
+
+
+def file_hash(*paths):
+
+    """ Returns the SHA-256 hex digest of the contents of the files."""
+
+    digest = hashlib.sha256()
+
+    for path in paths:
+        with open(path, "rb") as data_file:
+            for chunk in iter(lambda: data_file.read(1 << 20), b""):
+                digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def load_data(lcparam_path, sys_path, cache_dir=None):
+
+    """ This function loads the light curve and systematic error data.
+
+    Parameter:
+    1. lcparam_path - Path of the light curve parameter file.
+    2. sys_path - Path of the systematic error file.
+    3. cache_dir - Directory of the cache, by default a directory
+    named .data_cache next to the light curve parameter file.
+
+    Returns the LightCurveData and the nxn systematic error matrix,
+    which can be passed as data_lcparam and sys_error to the functions
+    of prior_likelihood. All arrays are read-only.
+    """
+
+    key = tuple(
+        (os.path.abspath(path), os.stat(path).st_size, os.stat(path).st_mtime_ns)
+        for path in (lcparam_path, sys_path)
+    )
+
+    if key in _LOADED:
+        return _LOADED[key]
+
+    if cache_dir is None:
+        cache_dir = os.path.join(
+            os.path.dirname(os.path.abspath(lcparam_path)), ".data_cache"
+        )
+
+    entry = os.path.join(cache_dir, file_hash(lcparam_path, sys_path))
+
+    if not os.path.isdir(entry):
+        _write_cache(entry, parse_lcparam(lcparam_path), parse_sys(sys_path))
+
+    columns = {
+        name[len("lc_") : -len(".npy")]: np.load(
+            os.path.join(entry, name), mmap_mode="r"
+        )
+        for name in sorted(os.listdir(entry))
+        if name.startswith("lc_")
+    }
+    sys_error = np.load(os.path.join(entry, "sys_error.npy"), mmap_mode="r")
+
+    _LOADED[key] = LightCurveData(columns), sys_error
+
+    return _LOADED[key]
+
+
+def _write_cache(entry, columns, sys_error):
+
+    """ Writes the arrays of a cache entry.
+
+    The arrays are written into a temporary directory that is then
+    renamed, so other processes never see a partial entry. If another
+    process wrote the same entry first, its entry is kept.
+    """
+
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    temporary = tempfile.mkdtemp(dir=os.path.dirname(entry))
+
+    for name, array in columns.items():
+        np.save(os.path.join(temporary, "lc_" + name + ".npy"), array)
+
+    np.save(os.path.join(temporary, "sys_error.npy"), sys_error)
+
+    try:
+        os.rename(temporary, entry)
+    except OSError:
+        shutil.rmtree(temporary)
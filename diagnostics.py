@@ -0,0 +1,245 @@
+""" Convergence diagnostics for MCMC chains.
+
+This file contains the diagnostics used to judge how well the chains
+of the samplers mix, such as the effective sample size.
+"""
+
+import numpy as np
+
+
+def autocorrelation(chain):
+
+    """ This function calculates the normalized autocorrelation function.
+
+    Parameter:
+    1. chain - Array of shape (n,) of the samples of one parameter.
+
+    Returns an array rho of shape (n,), with rho[0] = 1. It is computed
+    with the FFT in O(n log n).
+    """
+
+    chain = np.asarray(chain, dtype=float)
+    length = len(chain)
+    centred = chain - chain.mean()
+
+    spectrum = np.fft.rfft(centred, n=2 * length)
+    autocovariance = np.fft.irfft(spectrum * np.conj(spectrum))[:length]
+
+    if autocovariance[0] == 0:
+        return np.ones(length)
+
+    return autocovariance / autocovariance[0]
+
+
+def effective_sample_size(chain):
+
+    """ This function calculates the effective sample size.
+
+    The integrated autocorrelation time is summed with Geyer's initial
+    positive sequence: the sums rho_{2k} + rho_{2k+1} are added while
+    they stay positive.
+
+    Parameter:
+    1. chain - Array of shape (n,) or (n, d) of samples.
+
+    Returns the effective sample size, one per parameter for a chain
+    of shape (n, d).
+    """
+
+    chain = np.asarray(chain, dtype=float)
+
+    if chain.ndim == 2:
+        return np.array([effective_sample_size(column) for column in chain.T])
+
+    length = len(chain)
+
+    if length < 4:
+        return float(length)
+
+    rho = autocorrelation(chain)
+    pairs = rho[: length - length % 2].reshape(-1, 2).sum(axis=1)
+    negative = np.flatnonzero(pairs <= 0)
+    pairs = pairs[: negative[0] if len(negative) else len(pairs)]
+
+    autocorrelation_time = -1 + 2 * pairs.sum()
+
+    return float(length / max(autocorrelation_time, 1 / length))
+
+
+def merge_moments(first, second):
+
+    """ This function merges the moments of two sets of samples.
+
+    Each argument is a tuple (count, mean, sum of squared deviations),
+    and so is the result (Chan et al.'s parallel form of Welford's
+    algorithm).
+    """
+
+    count_a, mean_a, sq_dev_a = first
+    count_b, mean_b, sq_dev_b = second
+    count = count_a + count_b
+
+    if count == 0:
+        return 0, 0.0, 0.0
+
+    delta = mean_b - mean_a
+    mean = mean_a + delta * count_b / count
+    sq_dev = sq_dev_a + sq_dev_b + delta * delta * count_a * count_b / count
+
+    return count, mean, sq_dev
+
+
+class OnlineChainStats:
+
+    """ Streaming summary of one chain of a scalar parameter.
+
+    The chain is cut into consecutive batches whose moments (count,
+    mean, sum of squared deviations) are merged with Welford's
+    algorithm. When the number of full batches reaches 2*max_batches,
+    neighbouring batches are merged and the batch size doubles, so the
+    memory stays bounded while the batches cover the whole chain. This
+    gives the running mean and variance, the batch-means effective
+    sample size and the two halves of the chain needed for split-R-hat,
+    without storing the trace.
+    """
+
+    def __init__(self, max_batches=32):
+
+        self.max_batches = max_batches
+        self.batch_size = 1
+        self._batches = []  # moments of the full batches
+        self._partial = (0, 0.0, 0.0)  # moments of the batch being filled
+
+    def update(self, values):
+
+        """ Adds a block of consecutive samples of the chain."""
+
+        values = np.asarray(values, dtype=float)
+        start = 0
+
+        while start < len(values):
+            chunk = values[start : start + self.batch_size - self._partial[0]]
+            start += len(chunk)
+            chunk_mean = chunk.mean()
+            chunk_sq_dev = float(((chunk - chunk_mean) ** 2).sum())
+            self._partial = merge_moments(
+                self._partial, (len(chunk), chunk_mean, chunk_sq_dev)
+            )
+
+            if self._partial[0] == self.batch_size:
+                self._batches.append(self._partial)
+                self._partial = (0, 0.0, 0.0)
+
+            if len(self._batches) == 2 * self.max_batches:
+                self._batches = [
+                    merge_moments(self._batches[i], self._batches[i + 1])
+                    for i in range(0, len(self._batches), 2)
+                ]
+                self.batch_size *= 2
+
+    def moments(self):
+
+        """ Returns (count, mean, sum of squared deviations) of the chain."""
+
+        return _merge_all(self._batches + [self._partial])
+
+    @property
+    def count(self):
+
+        """ Number of samples seen."""
+
+        return self.moments()[0]
+
+    @property
+    def mean(self):
+
+        """ Running mean of the chain."""
+
+        return self.moments()[1]
+
+    @property
+    def variance(self):
+
+        """ Running variance of the chain."""
+
+        count, _, sq_dev = self.moments()
+
+        return sq_dev / (count - 1) if count > 1 else np.nan
+
+    def ess(self):
+
+        """ Batch-means effective sample size of the full batches.
+
+        ESS = n var / (b var_batch_means), which needs at least two
+        full batches (nan otherwise).
+        """
+
+        if len(self._batches) < 2:
+            return np.nan
+
+        means = np.array([mean for _, mean, _ in self._batches])
+        count, _, sq_dev = _merge_all(self._batches)
+
+        variance = sq_dev / (count - 1)
+        batch_variance = self.batch_size * means.var(ddof=1)
+
+        if batch_variance == 0:
+            return float(count)
+
+        return float(count * variance / batch_variance)
+
+    def halves(self):
+
+        """ Returns the moments of the first and second half of the full
+        batches (the oldest batch is left out if their number is odd).
+        """
+
+        half = len(self._batches) // 2
+        skipped = len(self._batches) - 2 * half
+
+        return (
+            _merge_all(self._batches[skipped : skipped + half]),
+            _merge_all(self._batches[skipped + half :]),
+        )
+
+
+def _merge_all(batches):
+
+    """ Returns the merged moments of a list of batch moments."""
+
+    total = (0, 0.0, 0.0)
+
+    for batch in batches:
+        total = merge_moments(total, batch)
+
+    return total
+
+
+def split_rhat(chain_stats):
+
+    """ This function calculates the split-R-hat of several chains.
+
+    Parameter:
+    1. chain_stats - One OnlineChainStats per chain.
+
+    Each chain is split into its two halves, and the potential scale
+    reduction factor sqrt(var+/W) is computed over the 2M half-chains.
+    Returns nan while some chain has fewer than two full batches.
+    """
+
+    halves = [half for stats in chain_stats for half in stats.halves()]
+
+    if any(count < 2 for count, _, _ in halves):
+        return np.nan
+
+    length = np.mean([count for count, _, _ in halves])
+    means = np.array([mean for _, mean, _ in halves])
+    within = np.mean([sq_dev / (count - 1) for count, _, sq_dev in halves])
+    between = length * means.var(ddof=1)
+
+    if within == 0:
+        return np.nan
+
+    pooled = (length - 1) / length * within + between / length
+
+    return float(np.sqrt(pooled / within))
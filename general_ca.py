@@ -0,0 +1,331 @@
+""" Cellular automata with k states and any neighborhood
+
+This is a single engine for one dimensional CAs on a periodic lattice
+with k states per cell and a neighborhood given by a list of offsets:
+offsets (-1, 0, 1) with k=2 are the ECAs of two_state, offsets (-1, 0)
+with k=3 are the rules of three_state, and range(-r, r+1) is the
+symmetric neighborhood of radius r.
+
+The neighborhood of every cell is encoded as the base-k integer
+
+code = c[x+o_1] k^(m-1) + c[x+o_2] k^(m-2) + ... + c[x+o_m]
+
+built with Horner's scheme over shifted copies of the whole
+configuration, and the new cells are read from a flat uint8 table of
+the k^m outputs. As for ECAs, the i-th base-k digit of the rule number
+is the output of the neighborhood with code i, so rule numbers range
+from 0 to k^(k^m)-1. Such numbers quickly become huge (4^1024 for k=4
+and r=2), so rules can also be given directly as their table.
+"""
+import numpy as np
+from streaming import iter_blocks, reserve_rows
+
+
+def symmetric_offsets(radius):
+
+    """Returns the offsets -radius, ..., radius of the symmetric
+    neighborhood of the given radius.
+    """
+
+    if not isinstance(radius, int) or radius < 0:
+        raise ValueError("radius must be a non-negative integer")
+
+    return tuple(range(-radius, radius + 1))
+
+
+def code_dtype(table_size):
+
+    """Returns the smallest unsigned dtype that holds the codes of a
+    table of the given size.
+    """
+
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if table_size - 1 <= np.iinfo(dtype).max:
+            return dtype
+
+    return np.uint64
+
+
+def compile_rule(rule, states, neighborhood_size):
+
+    """Returns the lookup table of a rule as a flat uint8 array.
+
+    Parameters
+    ----------
+    rule: int or array_like
+        Rule number between 0 and k^(k^m)-1, inclusive, whose i-th base
+        k digit is the output of the neighborhood with code i; or the
+        table of the k^m outputs itself.
+    states: int
+        Number of states k, at least 2.
+    neighborhood_size: int
+        Number m of cells in the neighborhood.
+
+    Returns
+    -------
+    rule_array: numpy.ndarray
+        Array of k^m uint8 outputs, indexed by the neighborhood code.
+    """
+
+    if not isinstance(states, int) or not 2 <= states <= 256:
+        raise ValueError("states must be an int between 2 and 256, inclusive")
+
+    table_size = states ** neighborhood_size
+
+    if isinstance(rule, (int, np.integer)):
+        rule = int(rule)
+        if rule < 0 or rule >= states ** table_size:
+            raise ValueError(
+                "rule number must be an int between 0 and k**(k**m)-1, inclusive"
+            )
+
+        # the digits are peeled off a few at a time, so each big int
+        # division handles many digits at once
+
+        digits_per_word = max(1, 60 // states.bit_length())
+        word = states ** digits_per_word
+        rule_array = np.empty(table_size, dtype=np.uint8)
+
+        for start in range(0, table_size, digits_per_word):
+            rule, chunk = divmod(rule, word)
+            for i in range(start, min(start + digits_per_word, table_size)):
+                chunk, rule_array[i] = divmod(chunk, states)
+
+        return rule_array
+
+    rule_array = np.asarray(rule)
+
+    if rule_array.shape != (table_size,):
+        raise ValueError("the rule table must hold k**m outputs")
+    if rule_array.min() < 0 or rule_array.max() >= states:
+        raise ValueError("the outputs of the rule table must be in range(k)")
+
+    return rule_array.astype(np.uint8)
+
+
+def rule_number(rule_array, states):
+
+    """Returns the rule number of a lookup table (see compile_rule)."""
+
+    number = 0
+
+    for output in reversed(np.asarray(rule_array).tolist()):
+        number = number * states + output
+
+    return number
+
+
+def random_rule(states, neighborhood_size, seed=None):
+
+    """Returns the table of a uniformly random rule."""
+
+    rng = np.random.default_rng(seed)
+
+    return rng.integers(0, states, states ** neighborhood_size, dtype=np.uint8)
+
+
+def neighborhood_codes(configuration, states, offsets):
+
+    """Returns the base-k code of every cell's neighborhood.
+
+    The last axis of the configuration is the (periodic) lattice, and
+    c[x+o] is found by shifting the whole configuration by -o.
+    """
+
+    configuration = np.asarray(configuration, dtype=np.uint8)
+    codes = np.roll(configuration, -offsets[0], axis=-1).astype(
+        code_dtype(states ** len(offsets))
+    )
+
+    for offset in offsets[1:]:
+        codes *= states
+        codes += np.roll(configuration, -offset, axis=-1)
+
+    return codes
+
+
+def evolve_step(configuration, rule_array, states, offsets, out=None):
+
+    """Returns the configuration one time step later.
+
+    Parameters
+    ----------
+    configuration: numpy.ndarray
+        uint8 array of cells in range(k). The last axis is the
+        (periodic) lattice, so stacks of configurations are evolved
+        together.
+    rule_array: numpy.ndarray
+        k^m-entry uint8 lookup table, see compile_rule.
+    states: int
+        Number of states k.
+    offsets: sequence of int
+        The m offsets of the neighborhood.
+    out: numpy.ndarray, optional
+        Array the new configuration is written into.
+    """
+
+    return np.take(
+        rule_array, neighborhood_codes(configuration, states, offsets), out=out
+    )
+
+
+def _check_initial_condition(initial_condition, states):
+
+    initial_condition = np.asarray(initial_condition)
+
+    if initial_condition.ndim != 1 or not np.isin(
+        initial_condition, np.arange(states)
+    ).all():
+        raise ValueError("initial condition must be a list of states in range(k)")
+
+    return initial_condition.astype(np.uint8)
+
+
+def spacetime_field(rule, states, offsets, initial_condition, time_steps):
+
+    """Returns the spacetime field of a run.
+
+    Parameters
+    ----------
+    rule: int or array_like
+        Rule number or table, see compile_rule.
+    states: int
+        Number of states k.
+    offsets: sequence of int
+        The offsets of the neighborhood.
+    initial_condition: array_like
+        Initial configuration of cells in range(k).
+    time_steps: int
+        Non-negative number of time steps.
+
+    Returns
+    -------
+    out: numpy.ndarray
+        (time_steps+1, N) uint8 array whose row t is the configuration
+        at time t.
+    """
+
+    if not isinstance(time_steps, int) or time_steps < 0:
+        raise ValueError("time_steps must be a non-negative integer")
+
+    offsets = tuple(offsets)
+    rule_array = compile_rule(rule, states, len(offsets))
+    initial_condition = _check_initial_condition(initial_condition, states)
+
+    field = np.empty((time_steps + 1, len(initial_condition)), dtype=np.uint8)
+    field[0] = initial_condition
+
+    for t in range(time_steps):
+        evolve_step(field[t], rule_array, states, offsets, out=field[t + 1])
+
+    return field
+
+
+def iter_spacetime(
+    rule, states, offsets, initial_condition, time_steps=None, block_size=None
+):
+
+    """Yields the spacetime field one configuration at a time.
+
+    The arguments are those of spacetime_field. The stream never ends
+    if time_steps is None, and (block_size, N) blocks of rows are
+    yielded instead of single rows if block_size is given.
+    """
+
+    offsets = tuple(offsets)
+    rule_array = compile_rule(rule, states, len(offsets))
+    configuration = _check_initial_condition(initial_condition, states)
+
+    def rows():
+        current = configuration
+        t = 0
+        while True:
+            yield current
+            if time_steps is not None and t == time_steps:
+                return
+            current = evolve_step(current, rule_array, states, offsets)
+            t += 1
+
+    if block_size is None:
+        return rows()
+
+    return iter_blocks(rows(), block_size)
+
+
+class GeneralCA:
+
+    """A k-state CA with a given neighborhood.
+
+    Attributes
+    ----------
+    states: int
+        Number of states k.
+    offsets: tuple
+        The offsets of the neighborhood.
+    rule_array: numpy.ndarray
+        The compiled lookup table of the rule.
+    spacetime: numpy.ndarray
+        (T+1, N) uint8 array of the configurations evolved so far.
+    """
+
+    def __init__(self, rule, initial_condition, states=2, offsets=(-1, 0, 1)):
+
+        """Initializing the CA.
+
+        Parameters
+        ----------
+        rule: int or array_like
+            Rule number or table, see compile_rule.
+        initial_condition: array_like
+            Initial configuration of cells in range(states).
+        states: int, optional (default=2)
+            Number of states k.
+        offsets: sequence of int, optional (default=(-1, 0, 1))
+            The offsets of the neighborhood, e.g.
+            symmetric_offsets(r).
+        """
+
+        self.states = states
+        self.offsets = tuple(offsets)
+        self.rule_array = compile_rule(rule, states, len(self.offsets))
+
+        # the rows live in a buffer grown by streaming.reserve_rows
+
+        self._buffer = _check_initial_condition(initial_condition, states)[None]
+        self._rows = 1
+
+    @property
+    def spacetime(self):
+
+        """View of the filled rows of the buffer."""
+
+        return self._buffer[: self._rows]
+
+    def rule_number(self):
+
+        """Returns the rule number of the CA."""
+
+        return rule_number(self.rule_array, self.states)
+
+    def evolve(self, time_steps):
+
+        """Evolves the current configuration the given number of time
+        steps and appends the new configurations to the spacetime.
+        """
+
+        if not isinstance(time_steps, int) or time_steps < 0:
+            raise ValueError("time_steps must be a non-negative integer")
+
+        rows = self._rows + time_steps
+        self._buffer = reserve_rows(self._buffer, self._rows, rows)
+
+        for t in range(self._rows - 1, rows - 1):
+            evolve_step(
+                self._buffer[t],
+                self.rule_array,
+                self.states,
+                self.offsets,
+                out=self._buffer[t + 1],
+            )
+
+        self._rows = rows
@@ -0,0 +1,223 @@
+""" Opt-in instrumentation of long simulations and samplers
+
+Long runs of ThreeStateCA.evolve and bayesian.metropolis_hastings take
+an instrument=None argument. Given an Instrument, the run counts its
+steps, accepted proposals and posterior evaluations, times its phases
+and, every `every` steps, sends a progress record to the sinks of the
+instrument:
+
+    {"run": "metropolis_hastings", "event": "progress", "time": ...,
+     "elapsed": ..., "steps": ..., "total_steps": ..., "step_rate": ...,
+     "mean_step_rate": ..., "acceptance_rate": ..., "evaluations": ...,
+     "memory_bytes": ..., "phases": {"draw": ..., "sample": ...}}
+
+A sink is any callable taking the record; JSONLinesSink appends the
+records to a file and SocketSink sends them as datagrams to a local
+metrics exporter. Runs only touch the instrument between blocks of
+steps, so an instrument costs little, and no instrument (the default)
+costs a single None check per block.
+"""
+import contextlib
+import json
+import socket
+import time
+
+
+class Instrument:
+
+    """Counters, phase timers and periodic reports of one run.
+
+    Attributes
+    ----------
+    every: int
+        Number of steps between two progress records.
+    sinks: list
+        Callables that receive every record.
+    records: list
+        The records of the current run, if keep_records is True.
+    """
+
+    def __init__(self, every=1000, sinks=(), keep_records=False):
+
+        """Initializing the instrument.
+
+        Parameters
+        ----------
+        every: int, optional (default=1000)
+            Positive integer, the number of steps between two progress
+            records.
+        sinks: iterable, optional (default=())
+            Callables that receive every record.
+        keep_records: bool, optional (default=False)
+            If True, the records are also kept in the records
+            attribute.
+        """
+
+        if not isinstance(every, int) or every < 1:
+            raise ValueError("every must be a positive integer")
+
+        self.every = every
+        self.sinks = list(sinks)
+        self.keep_records = keep_records
+        self.start()
+
+    def start(self, run=None, total_steps=None):
+
+        """Resets the counters at the start of a run."""
+
+        self.run = run
+        self.total_steps = total_steps
+        self.records = []
+        self.steps = 0
+        self.accepted = None
+        self.evaluations = 0
+        self.memory_bytes = None
+        self.phases = {}
+        self._start_time = time.perf_counter()
+        self._last_time = self._start_time
+        self._last_steps = 0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+
+        """Context manager adding its wall time to the given phase."""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + (
+                time.perf_counter() - start
+            )
+
+    def step(self, steps=1, accepted=None, evaluations=0, memory_bytes=None):
+
+        """Counts steps of the run, and reports once every steps have
+        passed since the last report.
+
+        Parameters
+        ----------
+        steps: int, optional (default=1)
+            Number of steps done.
+        accepted: int, optional (default=None)
+            Number of accepted proposals among them, for samplers.
+        evaluations: int, optional (default=0)
+            Number of posterior evaluations among them.
+        memory_bytes: int, optional (default=None)
+            Current size of the stored trace or spacetime.
+        """
+
+        self.steps += steps
+        self.evaluations += evaluations
+
+        if accepted is not None:
+            self.accepted = (self.accepted or 0) + accepted
+        if memory_bytes is not None:
+            self.memory_bytes = memory_bytes
+
+        if self.steps - self._last_steps >= self.every:
+            self.report()
+
+    def report(self, event="progress"):
+
+        """Sends a record of the run so far to the sinks and returns it."""
+
+        now = time.perf_counter()
+        elapsed = now - self._start_time
+        interval = now - self._last_time
+
+        record = {
+            "run": self.run,
+            "event": event,
+            "time": time.time(),
+            "elapsed": elapsed,
+            "steps": self.steps,
+            "total_steps": self.total_steps,
+            "step_rate": (self.steps - self._last_steps) / interval
+            if interval > 0
+            else None,
+            "mean_step_rate": self.steps / elapsed if elapsed > 0 else None,
+            "acceptance_rate": self.accepted / self.steps
+            if self.accepted is not None and self.steps
+            else None,
+            "evaluations": self.evaluations,
+            "memory_bytes": self.memory_bytes,
+            "phases": dict(self.phases),
+        }
+
+        self._last_time = now
+        self._last_steps = self.steps
+
+        if self.keep_records:
+            self.records.append(record)
+
+        for sink in self.sinks:
+            sink(record)
+
+        return record
+
+    def finish(self):
+
+        """Sends the final record of the run and returns it."""
+
+        return self.report(event="finish")
+
+
+def phase(instrument, name):
+
+    """Returns instrument.phase(name), or a context manager that does
+    nothing if instrument is None.
+    """
+
+    if instrument is None:
+        return contextlib.nullcontext()
+
+    return instrument.phase(name)
+
+
+class JSONLinesSink:
+
+    """Appends every record as one line of JSON to a file."""
+
+    def __init__(self, path):
+
+        self.path = path
+        self._file = open(path, "a")
+
+    def __call__(self, record):
+
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def close(self):
+
+        self._file.close()
+
+
+class SocketSink:
+
+    """Sends every record as a JSON datagram to a local exporter.
+
+    The address is a path for a Unix datagram socket or a (host, port)
+    tuple for UDP. Datagrams are never waited for, and records that
+    cannot be sent (e.g. while the exporter is down) are dropped, so the
+    run is never slowed down or stopped by the exporter.
+    """
+
+    def __init__(self, address):
+
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self.address = address
+        self._socket = socket.socket(family, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def __call__(self, record):
+
+        try:
+            self._socket.sendto(json.dumps(record).encode(), self.address)
+        except OSError:
+            pass
+
+    def close(self):
+
+        self._socket.close()
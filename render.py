@@ -0,0 +1,307 @@
+""" Headless rendering of spacetime fields to image files
+
+Spacetime fields are written straight to palette PNG or binary PGM
+files, without matplotlib, a figure or a display. Cells are mapped to
+pixels through a palette (white for state 0, black for the highest
+state, like the Greys colormap of spacetime_diagram), so the pixel
+bytes are the uint8 array itself. Fields too large to view are
+downsampled by blocks of factor x factor cells, either to the most
+frequent state of each block or to its mean density. Rows are
+compressed and written slab by slab, so streams of rows (e.g. from
+iter_spacetime or a SpacetimeStore) are rendered in O(N) memory.
+"""
+import struct
+import zlib
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def greys(levels):
+
+    """Returns the grey level of each of the given number of levels,
+    from white (255) for level 0 to black (0) for the last level.
+    """
+
+    if levels < 2:
+        raise ValueError("levels must be at least 2")
+
+    return np.round(255 - 255 * np.arange(levels) / (levels - 1)).astype(np.uint8)
+
+
+def downsample(field, factor, states, mode="majority"):
+
+    """Reduces a field by blocks of factor x factor cells.
+
+    Parameters
+    ----------
+    field: array_like
+        (T, N) array of cells with values in range(states).
+    factor: int
+        Positive integer, the side of the blocks. The blocks of the
+        last rows and columns are cut short when factor does not
+        divide T or N.
+    states: int
+        Number of states of the cells.
+    mode: str, optional (default="majority")
+        "majority" gives the most frequent state of each block (the
+        lowest one in case of a tie), "density" the mean state of each
+        block, scaled to a level in range(256).
+
+    Returns
+    -------
+    out: numpy.ndarray
+        (ceil(T/factor), ceil(N/factor)) uint8 array of states, or of
+        density levels.
+    """
+
+    if not isinstance(factor, int) or factor < 1:
+        raise ValueError("factor must be a positive integer")
+
+    field = np.asarray(field, dtype=np.uint8)
+    row_starts = np.arange(0, field.shape[0], factor)
+    col_starts = np.arange(0, field.shape[1], factor)
+
+    def block_sums(values):
+        sums = np.add.reduceat(values, row_starts, axis=0)
+        return np.add.reduceat(sums, col_starts, axis=1)
+
+    if mode == "majority":
+        if factor == 1:
+            return field.copy()
+        counts = np.stack(
+            [block_sums((field == state).astype(np.int32)) for state in range(states)]
+        )
+        return counts.argmax(axis=0).astype(np.uint8)
+
+    if mode == "density":
+        heights = np.diff(np.append(row_starts, field.shape[0]))
+        widths = np.diff(np.append(col_starts, field.shape[1]))
+        means = block_sums(field.astype(np.int64)) / np.outer(heights, widths)
+        return np.round(means * 255 / (states - 1)).astype(np.uint8)
+
+    raise ValueError("mode must be 'majority' or 'density'")
+
+
+def _png_chunk(kind, data):
+
+    """Returns a PNG chunk: length, type, data and CRC."""
+
+    return (
+        struct.pack(">I", len(data))
+        + kind
+        + data
+        + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+    )
+
+
+class ImageWriter:
+
+    """Writes an 8-bit image to a PNG or PGM file row block by row
+    block.
+
+    PNG files hold the pixel values as palette indices; PGM files hold
+    the grey levels of the palette. The image height must be known in
+    advance, since both headers record it.
+    """
+
+    def __init__(self, path, width, height, palette, compress_level=6):
+
+        """Opens the file and writes the header.
+
+        Parameters
+        ----------
+        path: str
+            Path of the image; the format is chosen from its extension
+            (.png or .pgm).
+        width, height: int
+            Size of the image in pixels.
+        palette: array_like
+            Grey level (shape (L,)) or RGB colour (shape (L, 3)) of
+            each of the L pixel values. PGM files only take grey
+            levels.
+        compress_level: int, optional (default=6)
+            zlib compression level of PNG files.
+        """
+
+        palette = np.asarray(palette, dtype=np.uint8)
+
+        if path.lower().endswith(".png"):
+            self.format = "png"
+        elif path.lower().endswith(".pgm"):
+            self.format = "pgm"
+            if palette.ndim != 1:
+                raise ValueError("PGM images take a palette of grey levels")
+        else:
+            raise ValueError("path must end with .png or .pgm")
+
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self._palette = palette
+        self._file = open(path, "wb")
+
+        if self.format == "png":
+            colours = palette if palette.ndim == 2 else np.stack([palette] * 3, 1)
+            self._compressor = zlib.compressobj(compress_level)
+            self._file.write(PNG_SIGNATURE)
+            header = struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)
+            self._file.write(_png_chunk(b"IHDR", header))
+            self._file.write(_png_chunk(b"PLTE", colours.tobytes()))
+        else:
+            self._file.write(b"P5\n%d %d\n255\n" % (width, height))
+
+    def write(self, rows):
+
+        """Writes a (B, width) block of pixel values."""
+
+        rows = np.asarray(rows, dtype=np.uint8)
+
+        if rows.ndim != 2 or rows.shape[1] != self.width:
+            raise ValueError("rows must be an array of shape (B, width)")
+        if self.rows_written + len(rows) > self.height:
+            raise ValueError("more rows than the height of the image")
+
+        if self.format == "png":
+
+            # every scanline starts with the filter type 0 (None)
+
+            scanlines = np.zeros((len(rows), self.width + 1), dtype=np.uint8)
+            scanlines[:, 1:] = rows
+            data = self._compressor.compress(scanlines.tobytes())
+            if data:
+                self._file.write(_png_chunk(b"IDAT", data))
+        else:
+            self._file.write(self._palette[rows].tobytes())
+
+        self.rows_written += len(rows)
+
+    def close(self):
+
+        """Finishes the file. Every row must have been written."""
+
+        if self._file.closed:
+            return
+
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(
+                    "{} of {} rows were written".format(self.rows_written, self.height)
+                )
+            if self.format == "png":
+                self._file.write(_png_chunk(b"IDAT", self._compressor.flush()))
+                self._file.write(_png_chunk(b"IEND", b""))
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        if exc_info[0] is None:
+            self.close()
+        else:
+            self._file.close()
+
+
+def render_stream(
+    blocks, path, length, height, states, factor=1, mode="majority", compress_level=6
+):
+
+    """Renders a stream of row blocks to an image file.
+
+    Parameters
+    ----------
+    blocks: iterable
+        Iterable of (B, N) arrays of consecutive rows, e.g.
+        iter_spacetime(rule, init, T, block_size=...). Blocks may have
+        any number of rows.
+    path: str
+        Path of the .png or .pgm file.
+    length: int
+        Number N of cells per row.
+    height: int
+        Total number of rows of the stream (T+1 for a run of T steps).
+    states: int
+        Number of states of the cells.
+    factor: int, optional (default=1)
+        Side of the blocks of cells that become one pixel.
+    mode: str, optional (default="majority")
+        Downsampling mode, see downsample.
+    compress_level: int, optional (default=6)
+        zlib compression level of PNG files.
+    """
+
+    palette = greys(256 if mode == "density" else states)
+    pending = []  # rows not yet rendered, fewer than factor of them
+    pending_rows = 0
+
+    with ImageWriter(
+        path, -(-length // factor), -(-height // factor), palette, compress_level
+    ) as writer:
+
+        for block in blocks:
+            block = np.asarray(block, dtype=np.uint8)
+            if block.ndim == 1:
+                block = block[None]
+            pending.append(block)
+            pending_rows += len(block)
+
+            if pending_rows >= factor:
+                rows = np.concatenate(pending) if len(pending) > 1 else pending[0]
+                cut = pending_rows - pending_rows % factor
+                writer.write(downsample(rows[:cut], factor, states, mode))
+                pending = [rows[cut:]] if cut < pending_rows else []
+                pending_rows -= cut
+
+        if pending_rows:
+            writer.write(downsample(np.concatenate(pending), factor, states, mode))
+
+
+def render(field, path, states=None, factor=None, max_size=None, mode="majority"):
+
+    """Renders a spacetime field to an image file.
+
+    Parameters
+    ----------
+    field: array_like or SpacetimeStore
+        (T, N) field of cells. It is read slab by slab, so a
+        SpacetimeStore is never unpacked all at once.
+    path: str
+        Path of the .png or .pgm file.
+    states: int, optional (default=None)
+        Number of states of the cells. By default the states of a
+        SpacetimeStore, or the largest cell value plus one (at least
+        2).
+    factor: int, optional (default=None)
+        Side of the blocks of cells that become one pixel. By default
+        1, or the smallest factor that fits the image in max_size x
+        max_size pixels.
+    max_size: int, optional (default=None)
+        Largest width and height of the image when factor is not
+        given.
+    mode: str, optional (default="majority")
+        Downsampling mode, see downsample.
+    """
+
+    if not hasattr(field, "shape"):
+        field = np.asarray(field, dtype=np.uint8)
+
+    height, length = field.shape
+
+    if states is None:
+        states = getattr(field, "states", None) or max(int(np.max(field)) + 1, 2)
+
+    if factor is None:
+        factor = 1
+        if max_size is not None:
+            factor = max(-(-height // max_size), -(-length // max_size), 1)
+
+    # slabs of about a million cells, in whole blocks of factor rows
+
+    slab = factor * max(1, (1 << 20) // max(length * factor, 1))
+    blocks = (field[start : start + slab] for start in range(0, height, slab))
+
+    render_stream(blocks, path, length, height, states, factor, mode)
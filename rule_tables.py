@@ -0,0 +1,128 @@
+""" Process-wide registry of compiled rule tables
+
+The lookup table of a rule is its rule number written in base k, one
+digit per neighborhood: 8 binary digits for the ECAs of two_state
+(neighborhood (left, center, right) at index 4*left + 2*center +
+right) and 9 ternary digits for the rules of three_state
+(neighborhood (left, self) at index 3*left + self). This module
+computes each table once per process as a compact uint8 array, so no
+simulation rebuilds one from a formatted string:
+
+- the tables of all 256 ECAs are built when the module is imported, as
+  rows of the (256, 8) array ECA_TABLES;
+- the tables of three state rules are built on first use and kept in
+  a bounded LRU cache of THREE_STATE_CACHE_SIZE rules;
+- eca_tables and three_state_tables return the tables of many rules
+  at once, for batch runs and sweeps.
+
+The returned arrays are read-only, since they are shared by every
+caller.
+"""
+import functools
+import numpy as np
+
+# Maximum number of three state rule tables kept in memory.
+
+THREE_STATE_CACHE_SIZE = 4096
+
+# Row r holds the table of ECA rule r, bit i of r being the output of
+# the neighborhood with code i.
+
+ECA_TABLES = (np.arange(256)[:, None] >> np.arange(8) & 1).astype(np.uint8)
+ECA_TABLES.setflags(write=False)
+
+
+def _check_rule_numbers(rule_numbers, largest, message):
+
+    """Raises ValueError unless every rule number is an int in
+    range(largest + 1).
+    """
+
+    rule_numbers = np.asarray(rule_numbers)
+
+    if rule_numbers.size and (
+        not np.issubdtype(rule_numbers.dtype, np.integer)
+        or rule_numbers.min() < 0
+        or rule_numbers.max() > largest
+    ):
+        raise ValueError(message)
+
+    return rule_numbers.astype(np.int64)
+
+
+def eca_table(rule_number):
+
+    """Returns the read-only table of 8 uint8 outputs of an ECA.
+
+    Parameters
+    ----------
+    rule_number: int
+        Integer value between 0 and 255, inclusive (Wolfram numbering
+        scheme).
+    """
+
+    if not isinstance(rule_number, int) or rule_number < 0 or rule_number > 255:
+        raise ValueError("rule_number must be an int between 0 and 255, inclusive")
+
+    return ECA_TABLES[rule_number]
+
+
+def eca_tables(rule_numbers):
+
+    """Returns the (R, 8) tables of a sequence of R ECA rule numbers."""
+
+    rule_numbers = _check_rule_numbers(
+        rule_numbers, 255, "rule_number must be an int between 0 and 255, inclusive"
+    )
+
+    return ECA_TABLES[rule_numbers.reshape(-1)]
+
+
+@functools.lru_cache(maxsize=THREE_STATE_CACHE_SIZE)
+def three_state_table(rule_number):
+
+    """Returns the read-only table of 9 uint8 outputs of a three state
+    rule.
+
+    Parameters
+    ----------
+    rule_number: int
+        Integer value between 0 and 3**9-1, inclusive.
+    """
+
+    if not isinstance(rule_number, int) or rule_number < 0 or rule_number > 3 ** 9 - 1:
+        raise ValueError("rule_number must be an int between 0 and 3**9-1, inclusive")
+
+    table = np.array([rule_number // 3 ** i % 3 for i in range(9)], dtype=np.uint8)
+    table.setflags(write=False)
+
+    return table
+
+
+def three_state_tables(rule_numbers):
+
+    """Returns the (R, 9) tables of a sequence of R three state rule
+    numbers, computed together without going through the cache.
+    """
+
+    rule_numbers = _check_rule_numbers(
+        rule_numbers,
+        3 ** 9 - 1,
+        "rule_number must be an int between 0 and 3**9-1, inclusive",
+    )
+
+    return (rule_numbers.reshape(-1, 1) // 3 ** np.arange(9) % 3).astype(np.uint8)
+
+
+def cache_info():
+
+    """Returns the statistics of the three state table cache."""
+
+    return three_state_table.cache_info()
+
+
+def clear_cache():
+
+    """Empties the three state table cache."""
+
+    three_state_table.cache_clear()
@@ -0,0 +1,281 @@
+""" Memory-mapped on-disk spacetime store
+
+Spacetime fields of long runs are written generation by generation
+into a memory-mapped .npy file instead of being kept in memory. Rows
+are bit-packed: one bit per cell for two-state CAs and two bits per
+cell for three-state CAs. A small JSON file next to the .npy records
+the lattice length, the rule and how many rows have been stored, so
+that an interrupted run can resume from its last stored row.
+"""
+import itertools
+import json
+import os
+import numpy as np
+from numpy.lib.format import open_memmap
+from streaming import iter_blocks
+
+
+def bits_per_cell(states):
+
+    """Returns the number of bits used to store a cell with the given
+    number of states (1 for two states, 2 for three or four states).
+    """
+
+    if states not in (2, 3, 4):
+        raise ValueError("states must be 2, 3 or 4")
+
+    return 1 if states == 2 else 2
+
+
+def pack_rows(rows, states):
+
+    """Packs the last axis of an array of cells into bytes.
+
+    Cell i is stored in the bits of byte i*b//8 starting at bit
+    i*b%8, where b = bits_per_cell(states).
+    """
+
+    rows = np.asarray(rows, dtype=np.uint8)
+
+    if bits_per_cell(states) == 1:
+        return np.packbits(rows, axis=-1, bitorder="little")
+
+    length = rows.shape[-1]
+    padded = np.zeros(rows.shape[:-1] + (-(-length // 4) * 4,), dtype=np.uint8)
+    padded[..., :length] = rows
+    quads = padded.reshape(padded.shape[:-1] + (-1, 4))
+
+    return quads[..., 0] | quads[..., 1] << 2 | quads[..., 2] << 4 | quads[..., 3] << 6
+
+
+def unpack_rows(packed, length, states):
+
+    """Inverse of pack_rows for rows of the given length."""
+
+    packed = np.asarray(packed, dtype=np.uint8)
+
+    if bits_per_cell(states) == 1:
+        return np.unpackbits(packed, axis=-1, bitorder="little")[..., :length]
+
+    shifts = np.array([0, 2, 4, 6], dtype=np.uint8)
+    cells = (packed[..., None] >> shifts) & 3
+
+    return cells.reshape(packed.shape[:-1] + (-1,))[..., :length]
+
+
+class SpacetimeStore:
+
+    """Bit-packed spacetime field backed by a memory-mapped .npy file.
+
+    Indexing a store (store[t], store[t0:t1], store[t0:t1, x0:x1])
+    unpacks only the requested rows, so fields much larger than memory
+    can be sliced and plotted.
+    """
+
+    def __init__(self, path, mode="r"):
+
+        """Opens an existing store.
+
+        Parameters
+        ----------
+        path: str
+            Path of the .npy file.
+        mode: str, optional (default="r")
+            "r" for read-only access, "r+" to append rows.
+        """
+
+        with open(path + ".json") as meta_file:
+            self._meta = json.load(meta_file)
+
+        self.path = path
+        self.length = self._meta["length"]
+        self.states = self._meta["states"]
+        self._packed = np.load(path, mmap_mode=mode)
+
+    @classmethod
+    def create(cls, path, length, states, capacity, rule_number=None):
+
+        """Creates an empty store for up to capacity rows.
+
+        Parameters
+        ----------
+        path: str
+            Path of the .npy file. Existing files are overwritten.
+        length: int
+            Number of cells N per row.
+        states: int
+            Number of cell states (2 or 3).
+        capacity: int
+            Maximum number of rows, T+1 for a run of T time steps.
+        rule_number: int, optional
+            Rule number recorded in the metadata, checked when a run
+            is resumed.
+        """
+
+        row_bytes = -(-length * bits_per_cell(states) // 8)
+        packed = open_memmap(
+            path, mode="w+", dtype=np.uint8, shape=(capacity, row_bytes)
+        )
+        del packed
+
+        meta = {
+            "length": length,
+            "states": states,
+            "rule_number": rule_number,
+            "rows": 0,
+        }
+        _write_meta(path, meta)
+
+        return cls(path, mode="r+")
+
+    @property
+    def capacity(self):
+
+        """Maximum number of rows the store can hold."""
+
+        return len(self._packed)
+
+    @property
+    def rule_number(self):
+
+        """Rule number recorded when the store was created."""
+
+        return self._meta["rule_number"]
+
+    @property
+    def shape(self):
+
+        """Shape (rows stored, N) of the unpacked spacetime field."""
+
+        return (len(self), self.length)
+
+    def __len__(self):
+
+        return self._meta["rows"]
+
+    def append(self, rows):
+
+        """Packs and stores a (B, N) block of rows after the last one.
+
+        The data is flushed to disk before the row count is updated, so
+        a crash never leaves the metadata ahead of the stored rows.
+        """
+
+        rows = np.atleast_2d(rows)
+        start = len(self)
+
+        if start + len(rows) > self.capacity:
+            raise ValueError("store capacity exceeded")
+
+        self._packed[start : start + len(rows)] = pack_rows(rows, self.states)
+        self._packed.flush()
+
+        self._meta["rows"] = start + len(rows)
+        _write_meta(self.path, self._meta)
+
+    def last_row(self):
+
+        """Returns the last stored row as a uint8 array."""
+
+        if not len(self):
+            raise ValueError("the store is empty")
+
+        return self[len(self) - 1]
+
+    def __getitem__(self, key):
+
+        rows, columns = key if isinstance(key, tuple) else (key, slice(None))
+        packed = self._packed[: len(self)][rows]
+
+        return unpack_rows(packed, self.length, self.states)[..., columns]
+
+    def __array__(self, dtype=None, copy=None):
+
+        return self[:].astype(dtype or np.uint8)
+
+
+def _write_meta(path, meta):
+
+    """Atomically replaces the JSON metadata of the store at path."""
+
+    with open(path + ".json.tmp", "w") as meta_file:
+        json.dump(meta, meta_file)
+
+    os.replace(path + ".json.tmp", path + ".json")
+
+
+def record(
+    path,
+    iter_spacetime,
+    rule_number,
+    initial_condition,
+    time_steps,
+    states,
+    block_size=1024,
+):
+
+    """Runs a CA and writes its spacetime field into a store.
+
+    If a store of the same run (rule number, lattice length, number of
+    time steps and initial condition) already exists at path, the run
+    resumes from its last stored row instead of starting over; a store
+    of another run raises ValueError.
+
+    Parameters
+    ----------
+    path: str
+        Path of the .npy file.
+    iter_spacetime: callable
+        Stream factory with the signature of two_state.iter_spacetime
+        or three_state.iter_spacetime.
+    rule_number: int
+        Rule number passed to iter_spacetime.
+    initial_condition: array_like
+        Initial condition of the run, compared with the first stored
+        row when a run is resumed.
+    time_steps: int
+        Non-negative number of time steps of the whole run.
+    states: int
+        Number of cell states (2 or 3).
+    block_size: int, optional (default=1024)
+        Number of rows packed and flushed to disk at a time.
+
+    Returns
+    -------
+    store: SpacetimeStore
+        The store holding the T+1 rows of the run.
+    """
+
+    length = len(initial_condition)
+
+    if os.path.exists(path) and os.path.exists(path + ".json"):
+        store = SpacetimeStore(path, mode="r+")
+        if (
+            store.rule_number != rule_number
+            or store.length != length
+            or store.states != states
+            or store.capacity != time_steps + 1
+        ):
+            raise ValueError("the store at path belongs to a different run")
+        if len(store) and not np.array_equal(
+            store[0], np.asarray(initial_condition, dtype=np.uint8)
+        ):
+            raise ValueError(
+                "the store at path was recorded from another initial condition"
+            )
+    else:
+        store = SpacetimeStore.create(
+            path, length, states, time_steps + 1, rule_number
+        )
+
+    if len(store):
+        start = store.last_row()
+        rows = iter_spacetime(rule_number, start, time_steps + 1 - len(store))
+        rows = itertools.islice(rows, 1, None)  # skip the stored row
+    else:
+        rows = iter_spacetime(rule_number, initial_condition, time_steps)
+
+    for block in iter_blocks(rows, block_size):
+        store.append(block)
+
+    return store
@@ -0,0 +1,357 @@
+""" Streaming spacetime evolution with bounded memory
+
+The generators two_state.iter_spacetime and three_state.iter_spacetime
+yield one configuration (or one block of rows) at a time instead of
+keeping the whole spacetime field. This module holds the pieces that
+attach to such a stream: a ring buffer of the last K rows,
+consumers that accumulate summary statistics, so that memory stays
+O(N) no matter how many time steps are run, and cycle detection that
+stops a stream once it has fallen into a periodic orbit. The engines
+that do keep the whole field grow it with reserve_rows.
+"""
+import itertools
+import numpy as np
+
+
+def iter_blocks(rows, block_size):
+
+    """Groups a stream of rows into blocks of block_size rows.
+
+    Parameters
+    ----------
+    rows: iterable
+        Iterable of 1D configurations of equal length.
+    block_size: int
+        Positive integer, the number of rows per block. The last block
+        holds the remaining rows and may be shorter.
+
+    Yields
+    ------
+    block: numpy.ndarray
+        (block_size, N) uint8 array of consecutive rows.
+    """
+
+    if not isinstance(block_size, int) or block_size < 1:
+        raise ValueError("block_size must be a positive integer")
+
+    block = None
+    filled = 0
+
+    for row in rows:
+        if block is None:
+            block = np.empty((block_size, len(row)), dtype=np.uint8)
+        block[filled] = row
+        filled += 1
+        if filled == block_size:
+            yield block
+            block = None
+            filled = 0
+
+    if filled:
+        yield block[:filled]
+
+
+def reserve_rows(buffer, filled, rows):
+
+    """Returns a buffer with room for at least rows rows.
+
+    The capacity doubles when the buffer fills up, so appending rows
+    over repeated evolve calls costs O(1) per row.
+
+    Parameters
+    ----------
+    buffer: numpy.ndarray
+        (capacity, N) uint8 array.
+    filled: int
+        Number of rows of buffer in use, copied if the buffer grows.
+    rows: int
+        Number of rows needed.
+
+    Returns
+    -------
+    out: numpy.ndarray
+        buffer itself if it is large enough, otherwise a new
+        (max(rows, 2*capacity), N) array starting with its filled rows.
+    """
+
+    if rows <= len(buffer):
+        return buffer
+
+    grown = np.empty((max(rows, 2 * len(buffer)), buffer.shape[1]), dtype=np.uint8)
+    grown[:filled] = buffer[:filled]
+
+    return grown
+
+
+class RingBuffer:
+
+    """Keeps the last K rows of a stream.
+
+    """
+
+    def __init__(self, capacity, length):
+
+        """Initializing the buffer.
+
+        Parameters
+        ----------
+        capacity: int
+            Non-negative integer K, the number of rows kept.
+        length: int
+            Length N of each row.
+        """
+
+        if not isinstance(capacity, int) or capacity < 0:
+            raise ValueError("capacity must be a non-negative integer")
+
+        self._rows = np.zeros((capacity, length), dtype=np.uint8)
+        self._next = 0  # index the next row is written to
+        self.count = 0  # total number of rows pushed
+
+    def push(self, rows):
+
+        """Adds a (B, N) block of rows, overwriting the oldest ones."""
+
+        rows = np.atleast_2d(rows)
+        capacity = len(self._rows)
+
+        if capacity:
+            dropped = max(len(rows) - capacity, 0)
+            positions = self._next + dropped + np.arange(len(rows) - dropped)
+            self._rows[positions % capacity] = rows[dropped:]
+            self._next = (self._next + len(rows)) % capacity
+
+        self.count += len(rows)
+
+    def rows(self):
+
+        """Returns the kept rows in chronological order as a (K, N) array."""
+
+        kept = min(self.count, len(self._rows))
+
+        return np.roll(self._rows, -self._next, axis=0)[len(self._rows) - kept :]
+
+
+class DensityCounter:
+
+    """Running per-state cell counts of a stream.
+
+    Attributes
+    ----------
+    counts: numpy.ndarray
+        Total number of cells seen in each state.
+    last_density: numpy.ndarray
+        Fraction of cells in each state in the most recent row.
+    """
+
+    def __init__(self, states=2):
+
+        self.counts = np.zeros(states, dtype=np.int64)
+        self.last_density = np.zeros(states)
+
+    def update(self, rows):
+
+        """Adds a (B, N) block of rows to the counts."""
+
+        self.counts += np.bincount(rows.ravel(), minlength=len(self.counts))
+        self.last_density = np.bincount(rows[-1], minlength=len(self.counts)) / max(
+            rows.shape[1], 1
+        )
+
+    def density(self):
+
+        """Returns the fraction of all cells seen in each state."""
+
+        return self.counts / max(self.counts.sum(), 1)
+
+
+class EntropyEstimator:
+
+    """Running spatial n-block entropy of a stream.
+
+    Every row contributes the counts of its N periodic windows of n
+    consecutive cells, encoded as base-k integers.
+    """
+
+    def __init__(self, block_length, states=2):
+
+        self._block_length = block_length
+        self._states = states
+        self.counts = np.zeros(states ** block_length, dtype=np.int64)
+
+    def update(self, rows):
+
+        """Adds the n-block counts of a (B, N) block of rows."""
+
+        codes = np.zeros(rows.shape, dtype=np.int64)
+        for shift in range(self._block_length):
+            codes = codes * self._states + np.roll(rows, -shift, axis=-1)
+
+        self.counts += np.bincount(codes.ravel(), minlength=len(self.counts))
+
+    def entropy(self):
+
+        """Returns the n-block Shannon entropy in bits."""
+
+        probabilities = self.counts[self.counts > 0] / self.counts.sum()
+
+        # summing p log2(1/p) rather than negating the sum of p log2(p)
+        # gives 0.0, not -0.0, for rows with a single n-block
+
+        return float((probabilities * np.log2(1 / probabilities)).sum())
+
+
+def consume(stream, consumers=(), history=0):
+
+    """Runs a stream to the end, feeding every block to the consumers.
+
+    Parameters
+    ----------
+    stream: iterable
+        Iterable of rows or (B, N) blocks of rows, e.g. from
+        two_state.iter_spacetime or three_state.iter_spacetime.
+    consumers: sequence, optional
+        Objects with an update(rows) method, called with each (B, N)
+        block, e.g. DensityCounter or EntropyEstimator.
+    history: int, optional (default=0)
+        Number K of most recent rows to keep.
+
+    Returns
+    -------
+    out: numpy.ndarray
+        (K', N) array of the last K' <= K rows of the stream.
+    """
+
+    buffer = None
+
+    for rows in stream:
+        rows = np.atleast_2d(rows)
+        if buffer is None:
+            buffer = RingBuffer(history, rows.shape[1])
+        for consumer in consumers:
+            consumer.update(rows)
+        buffer.push(rows)
+
+    if buffer is None:
+        return np.zeros((0, 0), dtype=np.uint8)
+
+    return buffer.rows()
+
+
+def find_cycle(new_stream, max_steps=None):
+
+    """Finds the first repeated configuration of a stream.
+
+    Brent's algorithm is used, so only two configurations are held at
+    a time and memory stays O(N) however long the transient and the
+    period are. The period is found first, by comparing every row with
+    a saved row that moves to times 2^k - 1; the transient is then
+    found by walking two copies of the stream, period rows apart,
+    until they meet. This reads the stream twice, and up to about
+    three times as many rows as the first repeat, in exchange for not
+    keeping the rows seen.
+
+    Parameters
+    ----------
+    new_stream: callable
+        Function without arguments returning a new iterable of 1D
+        uint8 configurations at times 0, 1, 2, ..., e.g. lambda:
+        two_state.iter_spacetime(rule_number, initial_condition). The
+        stream should be unbounded, or at least reach time
+        3*max_steps, since a repeat close to its end may be missed.
+    max_steps: int, optional (default=None)
+        If given, only repeats within the rows at times 0, ...,
+        max_steps count, and the stream is never read past time
+        3*max_steps.
+
+    Returns
+    -------
+    transient: int or None
+        Time at which the periodic orbit is entered, or None if the
+        stream ends (or max_steps is reached) before a configuration
+        repeats.
+    period: int or None
+        Period of the orbit, or None.
+    """
+
+    rows = iter(new_stream())
+    first = next(rows, None)
+
+    if first is None:
+        return None, None
+
+    # the first repeat at time transient + period <= max_steps is seen
+    # once the saved row is at time 2^k - 1 >= transient and
+    # 2^k >= period, so by time 3*max_steps
+
+    saved = np.array(first, dtype=np.uint8)
+    power = period = 1
+
+    for t, row in enumerate(rows, 1):
+        if np.array_equal(row, saved):
+            break
+        if max_steps is not None and t >= 3 * max_steps:
+            return None, None
+        if period == power:
+            saved = np.array(row, dtype=np.uint8)
+            power *= 2
+            period = 0
+        period += 1
+    else:
+        return None, None
+
+    ahead = itertools.islice(new_stream(), period, None)
+
+    for transient, (row, row_ahead) in enumerate(zip(new_stream(), ahead)):
+        if np.array_equal(row, row_ahead):
+            break
+
+    if max_steps is not None and transient + period > max_steps:
+        return None, None
+
+    return transient, period
+
+
+def tile_cycle(rows, time_steps):
+
+    """Builds a spacetime field, simulating only up to the first cycle.
+
+    The stream is advanced until a configuration repeats; the remaining
+    rows are filled in by tiling the periodic orbit.
+
+    Parameters
+    ----------
+    rows: iterable
+        Iterable of at least time_steps+1 1D configurations, e.g. from
+        two_state.iter_spacetime.
+    time_steps: int
+        Non-negative number of time steps.
+
+    Returns
+    -------
+    field: numpy.ndarray
+        (T+1, N) uint8 spacetime field.
+    transient: int or None
+        Time at which the periodic orbit is entered, or None if no
+        configuration repeats within time_steps.
+    period: int or None
+        Period of the orbit, or None.
+    """
+
+    seen = {}
+    field = None
+
+    for t, row in zip(range(time_steps + 1), rows):
+        if field is None:
+            field = np.empty((time_steps + 1, len(row)), dtype=np.uint8)
+        key = row.tobytes()
+        if key in seen:
+            transient = seen[key]
+            period = t - transient
+            orbit = transient + (np.arange(t, time_steps + 1) - transient) % period
+            field[t:] = field[orbit]
+            return field, transient, period
+        seen[key] = t
+        field[t] = row
+
+    return field, None, None
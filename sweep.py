@@ -0,0 +1,297 @@
+""" Multi-core rule-space sweeps of the three state CA
+
+This module classifies the behaviour of many three state CA rules
+over many random initial conditions. Rule numbers are split into
+shards that are run on a process pool. Each worker evolves its runs
+and sends back only a few numbers per run (transient length, period,
+densities and block entropy), never the spacetime fields.
+
+Finished shards are written to the output directory as columnar .npz
+files as soon as they arrive, so a sweep that crashes can be restarted
+with the same arguments and only runs the missing shards. The
+arguments of the sweep are kept in a manifest.json file next to the
+shards, and a sweep with other arguments refuses to reuse them. The
+shards are finally merged into a single results.npz file with one
+array per column.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import three_state
+from streaming import EntropyEstimator, tile_cycle
+
+COLUMNS = (
+    "rule_number",
+    "seed",
+    "transient",
+    "period",
+    "density_0",
+    "density_1",
+    "density_2",
+    "mean_density_0",
+    "mean_density_1",
+    "mean_density_2",
+    "block_entropy",
+)
+INT_COLUMNS = ("rule_number", "seed", "transient", "period")
+
+
+def initial_condition(seed, length):
+
+    """Returns the random initial condition of a seed, as a uint8 array
+    of 0s, 1s and 2s drawn from np.random.default_rng(seed).
+    """
+
+    return np.random.default_rng(seed).integers(0, 3, length, dtype=np.uint8)
+
+
+def run_metrics(rule_number, seed, length, time_steps, block_length=3):
+
+    """Evolves one run and returns its row of metrics.
+
+    Evolution stops at the first repeated configuration (see
+    streaming.tile_cycle), which is where most rules end up quickly on
+    small lattices. Transient and period are -1 if no configuration
+    repeats within time_steps.
+
+    Returns
+    -------
+    out: tuple
+        Values of the run in the order of COLUMNS.
+    """
+
+    rows = three_state.iter_spacetime(
+        rule_number, initial_condition(seed, length), time_steps
+    )
+    field, transient, period = tile_cycle(rows, time_steps)
+
+    final_density = np.bincount(field[-1], minlength=3) / max(length, 1)
+    mean_density = np.bincount(field.ravel(), minlength=3) / max(field.size, 1)
+
+    entropy = EntropyEstimator(block_length, states=3)
+    entropy.update(field[-1:])
+
+    return (
+        (rule_number, seed)
+        + (-1 if transient is None else transient, -1 if period is None else period)
+        + tuple(final_density)
+        + tuple(mean_density)
+        + (entropy.entropy(),)
+    )
+
+
+def run_shard(rule_numbers, seeds, length, time_steps):
+
+    """Runs every (rule, seed) pair of a shard.
+
+    Returns
+    -------
+    out: dict
+        Maps each name in COLUMNS to a 1D array with one entry per run.
+    """
+
+    rows = [
+        run_metrics(rule, seed, length, time_steps)
+        for rule in rule_numbers
+        for seed in seeds
+    ]
+    columns = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+
+    return {
+        name: np.array(values, dtype=np.int64 if name in INT_COLUMNS else np.float64)
+        for name, values in zip(COLUMNS, columns)
+    }
+
+
+def shard_path(output_dir, index):
+
+    """Returns the path of the .npz file of the shard with the given index."""
+
+    return os.path.join(output_dir, "shard_{:05d}.npz".format(index))
+
+
+def run_sweep(
+    output_dir,
+    rule_numbers,
+    seeds,
+    length,
+    time_steps,
+    shard_size=64,
+    max_workers=None,
+    progress=None,
+):
+
+    """Runs a sweep on a process pool and aggregates the results.
+
+    Parameters
+    ----------
+    output_dir: str
+        Directory of the shard files, of manifest.json and of
+        results.npz. Shards already present from an earlier,
+        interrupted sweep are not run again; ValueError is raised if
+        that sweep had other arguments.
+    rule_numbers: sequence
+        Rule numbers between 0 and 3**9-1, inclusive.
+    seeds: sequence
+        Seeds of the random initial conditions (see initial_condition).
+    length: int
+        Length of the initial conditions.
+    time_steps: int
+        Number of time steps of each run.
+    shard_size: int, optional (default=64)
+        Number of rule numbers per shard.
+    max_workers: int, optional
+        Number of worker processes, by default one per CPU.
+    progress: callable, optional
+        Called as progress(done, total) each time a shard is finished.
+
+    Returns
+    -------
+    out: dict
+        Maps each name in COLUMNS to a 1D array with one entry per run,
+        ordered by rule number and then seed. The same arrays are saved
+        in output_dir/results.npz.
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    rule_numbers = [int(rule) for rule in rule_numbers]
+    seeds = [int(seed) for seed in seeds]
+    _check_manifest(
+        output_dir,
+        {
+            "rule_numbers": rule_numbers,
+            "seeds": seeds,
+            "length": length,
+            "time_steps": time_steps,
+            "shard_size": shard_size,
+        },
+    )
+
+    shards = [
+        rule_numbers[start : start + shard_size]
+        for start in range(0, len(rule_numbers), shard_size)
+    ]
+    pending = [
+        index
+        for index in range(len(shards))
+        if not os.path.exists(shard_path(output_dir, index))
+    ]
+    done = len(shards) - len(pending)
+
+    if progress is not None:
+        progress(done, len(shards))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(run_shard, shards[index], seeds, length, time_steps): index
+            for index in pending
+        }
+        for future in as_completed(futures):
+            _save_shard(shard_path(output_dir, futures[future]), future.result())
+            done += 1
+            if progress is not None:
+                progress(done, len(shards))
+
+    # an empty shard keeps the column dtypes when there are no rules
+
+    parts = [run_shard([], seeds, length, time_steps)]
+    for index in range(len(shards)):
+        with np.load(shard_path(output_dir, index)) as shard:
+            parts.append({name: shard[name] for name in COLUMNS})
+
+    results = {
+        name: np.concatenate([part[name] for part in parts])
+        for name in COLUMNS
+    }
+    _save_shard(os.path.join(output_dir, "results.npz"), results)
+
+    return results
+
+
+def manifest_path(output_dir):
+
+    """Returns the path of the manifest of the sweep in output_dir."""
+
+    return os.path.join(output_dir, "manifest.json")
+
+
+def _check_manifest(output_dir, manifest):
+
+    """Writes the manifest of a new sweep, or raises ValueError if the
+    shards in output_dir were produced by a sweep with other arguments.
+    """
+
+    path = manifest_path(output_dir)
+
+    if os.path.exists(path):
+        with open(path) as manifest_file:
+            if json.load(manifest_file) != manifest:
+                raise ValueError(
+                    "the shards in output_dir belong to a sweep with other arguments"
+                )
+        return
+
+    if any(name.startswith("shard_") for name in os.listdir(output_dir)):
+        raise ValueError("output_dir holds shards of a sweep without a manifest")
+
+    with open(path + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+
+    os.replace(path + ".tmp", path)
+
+
+def _save_shard(path, columns):
+
+    """Writes the columns to path atomically, so that a crash never
+    leaves a partial file behind that would be taken as finished.
+    """
+
+    temporary = path[: -len(".npz")] + ".tmp.npz"
+    np.savez(temporary, **columns)
+    os.replace(temporary, path)
+
+
+def main(argv=None):
+
+    """Command line entry point of the sweep runner."""
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("output_dir")
+    parser.add_argument("--first-rule", type=int, default=0)
+    parser.add_argument("--last-rule", type=int, default=3 ** 9 - 1)
+    parser.add_argument("--seeds", type=int, default=10)
+    parser.add_argument("--length", type=int, default=64)
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--shard-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    start = time.time()
+
+    def print_progress(done, total):
+        print(
+            "{}/{} shards done, {:.1f} s elapsed".format(
+                done, total, time.time() - start
+            ),
+            file=sys.stderr,
+        )
+
+    run_sweep(
+        args.output_dir,
+        range(args.first_rule, args.last_rule + 1),
+        range(args.seeds),
+        args.length,
+        args.steps,
+        shard_size=args.shard_size,
+        max_workers=args.workers,
+        progress=print_progress,
+    )
+
+
+if __name__ == "__main__":
+    main()
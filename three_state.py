@@ -6,10 +6,15 @@ automaton. A given cell can take a value of
 cells above and to the left of the cell above. This
 code follows the PEP-8 guidance.
 """
+import argparse
 import random
+import itertools
 import numpy as np
-from matplotlib import pyplot as plt
-from matplotlib import cm
+import render
+import rule_tables
+import spacetime_store
+from instrumentation import phase
+from streaming import find_cycle, iter_blocks, reserve_rows, tile_cycle
 
 
 def random_string(length):
@@ -33,6 +38,213 @@ def random_string(length):
     return [random.randint(0, 2) for _ in range(length)]
 
 
+def compile_rule(rule_number):
+
+    """Returns the lookup table of a rule compiled into a uint8 array.
+
+    The table comes from the rule_tables registry, so it is computed
+    once per process and shared, read-only, by every caller.
+
+    Parameters
+    ----------
+    rule_number: int
+        Integer value between 0 and 3**9-1, inclusive.
+
+    Returns
+    -------
+    rule_array: numpy.ndarray
+        Read-only array of 9 uint8 outputs, where the neighborhood
+        (left, self) is found at index 3*left + self.
+    """
+
+    return rule_tables.three_state_table(rule_number)
+
+
+def neighborhood_codes(configuration):
+
+    """Returns the index 3*left + self of every cell's neighborhood.
+
+    The last axis of the configuration is the (periodic) lattice.
+    """
+
+    configuration = np.asarray(configuration, dtype=np.uint8)
+
+    return 3 * np.roll(configuration, 1, axis=-1) + configuration
+
+
+def evolve_step(configuration, rule_array, out=None):
+
+    """Returns the configuration one time step later.
+
+    Parameters
+    ----------
+    configuration: numpy.ndarray
+        uint8 array of 0s, 1s and 2s. The last axis is the (periodic)
+        lattice, so stacks of configurations are evolved together.
+    rule_array: numpy.ndarray
+        9-entry uint8 lookup table, see compile_rule.
+    out: numpy.ndarray, optional
+        Array the new configuration is written into.
+    """
+
+    return np.take(rule_array, neighborhood_codes(configuration), out=out)
+
+
+def batch_spacetime_fields(rule_numbers, initial_conditions, time_steps):
+
+    """Evolves every initial condition under every rule number at once.
+
+    Parameters
+    ----------
+    rule_numbers: array_like
+        Sequence of R ints between 0 and 3**9-1, inclusive.
+    initial_conditions: array_like (2D)
+        Stack of S initial conditions of length N, given as an (S, N)
+        array or list of lists of 0s, 1s and 2s.
+    time_steps: int
+        Positive integer specifying the number of time steps.
+
+    Returns
+    -------
+    out: numpy.ndarray
+        (R, S, T+1, N) uint8 array, so that out[r, s] is the spacetime
+        field of rule_numbers[r] applied to initial_conditions[s].
+    """
+
+    if time_steps < 0:
+        raise ValueError("time_steps must be a non-negative integer")
+
+    try:
+        time_steps = int(time_steps)
+    except ValueError:
+        raise ValueError("time_steps must be a non-negative integer")
+
+    initial_conditions = np.atleast_2d(np.asarray(initial_conditions))
+
+    if not np.isin(initial_conditions, [0, 1, 2]).all():
+        raise ValueError("initial conditions must be lists of 0s, 1s and 2s")
+
+    rule_arrays = rule_tables.three_state_tables(rule_numbers)
+
+    # offset each rule's neighborhoods into its own row of the
+    # flattened rule arrays
+
+    offsets = 9 * np.arange(len(rule_arrays)).reshape(-1, 1, 1)
+
+    fields = np.empty(
+        (len(rule_arrays), len(initial_conditions), time_steps + 1)
+        + initial_conditions.shape[1:],
+        dtype=np.uint8,
+    )
+    fields[:, :, 0] = initial_conditions
+
+    for t in range(time_steps):
+        fields[:, :, t + 1] = np.take(
+            rule_arrays, offsets + neighborhood_codes(fields[:, :, t])
+        )
+
+    return fields
+
+
+def iter_spacetime(rule_number, initial_condition, time_steps=None, block_size=None):
+
+    """Yields the spacetime field one configuration at a time.
+
+    Only the current configuration is kept in memory. See
+    streaming.consume for attaching a ring buffer and summary
+    statistics to the stream.
+
+    Parameters
+    ----------
+    rule_number: int
+        Integer value between 0 and 3**9-1, inclusive.
+    initial_condition: array_like
+        Initial condition of 0s, 1s and 2s.
+    time_steps: int, optional (default=None)
+        Non-negative number of time steps. The stream never ends if
+        None.
+    block_size: int, optional (default=None)
+        If given, (block_size, N) blocks of consecutive rows are
+        yielded instead of single rows.
+
+    Yields
+    ------
+    out: numpy.ndarray
+        uint8 configurations at times 0, 1, ..., time_steps (or blocks
+        of them).
+    """
+
+    if time_steps is not None:
+        if time_steps < 0:
+            raise ValueError("time_steps must be a non-negative integer")
+
+        try:
+            time_steps = int(time_steps)
+        except ValueError:
+            raise ValueError("time_steps must be a non-negative integer")
+
+    initial_condition = np.asarray(initial_condition)
+
+    if not np.isin(initial_condition, [0, 1, 2]).all():
+        raise ValueError("initial condition must be a list of 0s, 1s and 2s")
+
+    rule = compile_rule(rule_number)
+
+    def rows():
+        configuration = initial_condition.astype(np.uint8)
+        yield configuration
+        for _ in itertools.count() if time_steps is None else range(time_steps):
+            configuration = evolve_step(configuration, rule)
+            yield configuration
+
+    if block_size is None:
+        return rows()
+
+    return iter_blocks(rows(), block_size)
+
+
+def record_spacetime(path, rule_number, initial_condition, time_steps, block_size=1024):
+
+    """Writes the spacetime field into a memory-mapped .npy file.
+
+    Rows are 2-bit-packed and written as the run progresses. If the
+    run was interrupted, it resumes from the last stored row.
+
+    Returns
+    -------
+    store: spacetime_store.SpacetimeStore
+        Lazy view of the stored field, sliced like a (T+1, N) array.
+    """
+
+    return spacetime_store.record(
+        path,
+        iter_spacetime,
+        rule_number,
+        initial_condition,
+        time_steps,
+        states=3,
+        block_size=block_size,
+    )
+
+
+def attractor(rule_number, initial_condition, max_steps):
+
+    """Returns the transient length and period of an orbit.
+
+    Returns
+    -------
+    transient: int or None
+        Time at which the initial condition falls into a periodic
+        orbit, or None if no configuration repeats within max_steps.
+    period: int or None
+        Period of the orbit, or None.
+    """
+
+    return find_cycle(
+        lambda: iter_spacetime(rule_number, initial_condition), max_steps
+    )
+
+
 class ThreeStateCA:
 
     """Three state cellular automata simulator.
@@ -46,7 +258,7 @@ class ThreeStateCA:
     # condition to be passed as parameters as that is all you need to
     # know for the evolution of the cellular automata
 
-    def __init__(self, rule_number, initial_condition):
+    def __init__(self, rule_number, initial_condition, as_list=False):
 
         """Initializing the simulator.
 
@@ -65,6 +277,10 @@ class ThreeStateCA:
             String used as the initial condition for the three state
             CA. Elements of the list should be 0s,1s and 2s.
 
+        as_list: bool, optional (default=False)
+            If True, the spacetime field and the current configuration
+            are kept as Python lists instead of uint8 numpy arrays.
+
         Attributes
         ----------
         lookup_table: dict
@@ -74,11 +290,24 @@ class ThreeStateCA:
             Copy of the initial conditions used to instantiate the
             simulator.
         spacetime: array_like
-            2D array (list of lists) of the spacetime field created by
-            the simulator.
+            2D uint8 array of shape (T+1, N) of the spacetime field
+            created by the simulator (list of lists if as_list=True).
+            The array is a view of the filled rows of an internal
+            buffer; later evolve calls only write past them. Row t+1
+            is the successor of row t, except at the rows listed in
+            gaps.
+        gaps: list
+            Indices of the rows of spacetime that do not follow the
+            row before them: the configuration that iter_evolve had
+            reached when evolve was called again, appended before the
+            run continued from it.
         current_configuration: array_like
-            List of the spatial configuration of the three state CA at
-            the current time.
+            Spatial configuration of the three state CA at the current
+            time, as a uint8 array (list if as_list=True).
+        transient, period: int or None
+            Transient length and period of the orbit found by the last
+            evolve call with detect_cycles=True, counted from the
+            configuration that call started from.
         """
 
         for i in initial_condition:
@@ -86,13 +315,47 @@ class ThreeStateCA:
                 raise ValueError("initial condition must be a list of 0s, 1s and 2s")
 
         self.initial = initial_condition
-        self.spacetime = [initial_condition]
-        self.current_configuration = initial_condition.copy()
         self._length = len(initial_condition)
         self._rulen = rule_number
+        self._as_list = as_list
+        self.transient = None
+        self.period = None
+        self.gaps = []
+        self._detached = False  # iter_evolve ran past the last row
+
+        if as_list:
+            self._spacetime_list = [initial_condition]
+            self.current_configuration = initial_condition.copy()
+        else:
+
+            # the rows live in a buffer grown by streaming.reserve_rows
+
+            self._buffer = np.array(initial_condition, dtype=np.uint8).reshape(
+                1, self._length
+            )
+            self._rows = 1
+            self.current_configuration = self._buffer[0].copy()
 
         # the underscore before _length defines a private variable
 
+    @property
+    def spacetime(self):
+
+        """The spacetime field: a view of the filled rows of the buffer,
+        or the list of lists if as_list=True.
+        """
+
+        if self._as_list:
+            return self._spacetime_list
+
+        return self._buffer[: self._rows]
+
+    def _reserve(self, rows):
+
+        """Grows the buffer to hold rows rows."""
+
+        self._buffer = reserve_rows(self._buffer, self._rows, rows)
+
     # functions within a class is known as methods. Evolve is a method
     # of this class
 
@@ -115,16 +378,6 @@ class ThreeStateCA:
             (i.e. the lookup table), as specified by the rule number.
         """
 
-        if (
-            not isinstance(self._rulen, int)
-            or self._rulen < 0
-            or self._rulen > 3 ** 9 - 1
-        ):
-
-            raise ValueError(
-                "rule_number must be an int between 0 and 3**9-1, inclusive"
-            )
-
         # define the neighborhood
 
         neighborhoods = [
@@ -139,21 +392,26 @@ class ThreeStateCA:
             (2, 2),
         ]
 
-        # using numpy (for fun) to return base 3 representation of the rule
-        # number with 0 padding as necessary.
+        # the outputs come from the precompiled table of the rule (see
+        # rule_tables), which also validates the rule number. We will
+        # use the dict function to create the lookup table dictionary.
 
-        rule_ternary = np.base_repr(
-            self._rulen, 3, padding=9 - len(np.base_repr(self._rulen, 3))
-        )
+        return dict(zip(neighborhoods, self.rule_array().tolist()))
 
-        # we will use the dict function to create the lookup table
-        # dictionary. The zip function just takes two lists and combine
-        # them together to give you the dictionary. We use map so that
-        # outputs are ints, not strings
+    def rule_array(self):
 
-        return dict(zip(neighborhoods, map(int, reversed(rule_ternary))))
+        """Returns the lookup table compiled into a uint8 array.
 
-    def evolve(self, time_steps):
+        Returns
+        -------
+        rule_array: numpy.ndarray
+            Array of 9 uint8 outputs, where the neighborhood (left, self)
+            is found at index 3*left + self.
+        """
+
+        return compile_rule(self._rulen)
+
+    def evolve(self, time_steps, detect_cycles=False, instrument=None):
 
         """
         Evolves the current configuration of the three state CA for the
@@ -164,6 +422,17 @@ class ThreeStateCA:
         time_steps: int
             Positive integer specifying the number of time steps for
             evolving the ECA.
+        detect_cycles: bool, optional (default=False)
+            If True, evolution stops at the first repeated configuration
+            and the remaining time steps are filled in by tiling the
+            periodic orbit. The transient length and period are stored
+            in the transient and period attributes.
+        instrument: instrumentation.Instrument, optional (default=None)
+            If given, it gets the time steps and size of the spacetime
+            every instrument.every steps, and the time spent
+            allocating the spacetime ("allocate"), evolving it
+            ("evolve" or "detect_cycles") and converting it to lists
+            ("convert").
         """
 
         if time_steps < 0:
@@ -177,27 +446,116 @@ class ThreeStateCA:
         except ValueError:
             raise ValueError("time_steps must be a non-negative integer")
 
-        for _ in range(time_steps):
-            # use underscore if the index will not be used
+        if self._detached:
+            self._append_current()
+
+        # the rule is compiled once, and each generation is a single
+        # gather from the 9-entry table written straight into the
+        # buffer (a (T+1, N) array if as_list=True).
+
+        rule = self.rule_array()
+
+        if instrument is not None:
+            instrument.start("ThreeStateCA.evolve", time_steps)
+
+        with phase(instrument, "allocate"):
+            if self._as_list:
+                spacetime = np.empty((time_steps + 1, self._length), dtype=np.uint8)
+                spacetime[0] = self.current_configuration
+            else:
+                self._reserve(self._rows + time_steps)
+                spacetime = self._buffer[: self._rows + time_steps]
+
+        start = len(spacetime) - time_steps - 1
+        end = start + time_steps
+        memory_bytes = spacetime.nbytes if self._as_list else self._buffer.nbytes
+
+        seed = np.asarray(self.current_configuration, dtype=np.uint8)
+
+        if detect_cycles:
+            with phase(instrument, "detect_cycles"):
+                rows = iter_spacetime(self._rulen, seed, time_steps)
+                field, self.transient, self.period = tile_cycle(rows, time_steps)
+                spacetime[start + 1 :] = field[1:]
+            if instrument is not None:
+                instrument.step(time_steps, memory_bytes=memory_bytes)
+        else:
 
-            new_configuration = []
-            for i in range(self._length):
+            # with an instrument, the steps are run in chunks of
+            # instrument.every steps between two reports
 
-                neighborhood = (
-                    self.current_configuration[(i - 1)],
-                    self.current_configuration[i],
-                )
+            chunk = time_steps if instrument is None else instrument.every
 
-                new_configuration.append(self.lookup_table()[neighborhood])
+            for chunk_start in range(start, end, max(chunk, 1)):
+                chunk_end = min(chunk_start + chunk, end)
+                with phase(instrument, "evolve"):
+                    for t in range(chunk_start, chunk_end):
+                        source = seed if t == start else spacetime[t]
+                        evolve_step(source, rule, out=spacetime[t + 1])
+                if instrument is not None:
+                    instrument.step(chunk_end - chunk_start, memory_bytes=memory_bytes)
 
-            self.current_configuration = new_configuration
-            self.spacetime.append(new_configuration)
+        with phase(instrument, "convert"):
+            if self._as_list:
+                self._spacetime_list.extend(spacetime[1:].tolist())
+                self.current_configuration = list(self._spacetime_list[-1])
+            else:
+                self._rows += time_steps
+                self.current_configuration = spacetime[-1].copy()
 
+        if instrument is not None:
+            instrument.finish()
 
-def spacetime_diagram(spacetime_field, size=12, colors=cm.get_cmap("Greys")):
+    def _append_current(self):
+
+        """Appends current_configuration to spacetime as a gap row."""
+
+        self.gaps.append(len(self.spacetime))
+
+        if self._as_list:
+            self._spacetime_list.append(list(self.current_configuration))
+        else:
+            self._reserve(self._rows + 1)
+            self._buffer[self._rows] = self.current_configuration
+            self._rows += 1
+
+        self._detached = False
+
+    def iter_evolve(self, time_steps=None, block_size=None):
+
+        """
+        Evolves the current configuration like evolve, but yields the
+        new configurations instead of storing them in spacetime.
+
+        current_configuration is updated as the stream advances, so
+        memory stays O(N). The next evolve call appends the
+        configuration reached as a row of spacetime, listed in gaps,
+        and continues from it. See iter_spacetime for the parameters.
+        """
+
+        stream = iter_spacetime(self._rulen, self.current_configuration, time_steps)
+        next(stream)  # the current configuration itself
+
+        def rows():
+            for configuration in stream:
+                self._detached = True
+                if self._as_list:
+                    self.current_configuration = configuration.tolist()
+                else:
+                    self.current_configuration = configuration
+                yield configuration
+
+        if block_size is None:
+            return rows()
+
+        return iter_blocks(rows(), block_size)
+
+
+def spacetime_diagram(spacetime_field, size=12, colors=None, path=None):
     """
     Produces a simple spacetime diagram image using matplotlib
-    imshow with 'nearest' interpolation.
+    imshow with 'nearest' interpolation. matplotlib is only imported
+    here, so the rest of the module does not need it.
 
    Parameters
     ---------
@@ -208,20 +566,33 @@ def spacetime_diagram(spacetime_field, size=12, colors=cm.get_cmap("Greys")):
 
     size: int, optional (default=12)
         Sets the size of the figure: figsize=(size,size)
-    colors: matplotlib colormap, optional (default=cm.get_cmap("Greys"))
+    colors: matplotlib colormap or name, optional (default="Greys")
+    path: str, optional (default=None)
+        If given, the image is saved to this file instead of shown.
     """
+    from matplotlib import pyplot as plt
+
+    if colors is None:
+        colors = "Greys"
+
     plt.figure(figsize=(size, size))
     plt.imshow(spacetime_field, cmap=colors, interpolation="nearest")
-    plt.show()
+    if path is None:
+        plt.show()
+    else:
+        plt.savefig(path)
+        plt.close()
 
 
-def run_three_state_ca(rule_num, init_condition, time):
+def run_three_state_ca(rule_num, init_condition, time, path=None):
     """ This function runs the 3 state CA code.
 
     This function takes three parameters:
     1. rule_num -> This is the rule number.
     2. init_condition -> This is the initial condition.
     3. time -> This tells the number of timesteps.
+    4. path -> If given, the diagram is saved to this file
+    instead of shown.
     """
 
     # Initiating the three state CA class
@@ -234,36 +605,101 @@ def run_three_state_ca(rule_num, init_condition, time):
 
     # Plotting the spacetime field
 
-    spacetime_diagram(rule_user.spacetime)
+    spacetime_diagram(rule_user.spacetime, path=path)
 
 
-# We will have the user choose a rule number
+def prompt_arguments():
+    """ Asks the user for the rule number, initial condition and
+    number of timesteps.
 
-RULE_NUM = int(input("Choose a number between 0 and 3**9-1 as the rule number:"))
+    Returns
+    -------
+    out: tuple
+        The rule number, the initial condition as a list and the
+        number of timesteps.
+    """
+
+    # We will have the user choose a rule number
+
+    rule_num = int(input("Choose a number between 0 and 3**9-1 as the rule number:"))
 
-# Choose the length for the initial condition
+    # Choose the length for the initial condition
 
-LEN_INIT = int(input("Input the length of the initial condition:"))
+    len_init = int(input("Input the length of the initial condition:"))
 
-# We will have the user decide if they want to put in a random initial
-# condition or the one they want
+    # We will have the user decide if they want to put in a random initial
+    # condition or the one they want
 
-RANDOM_INIT = input("Enter Y if you want a random initial condition else enter N:")
+    random_init = input("Enter Y if you want a random initial condition else enter N:")
 
-if RANDOM_INIT in ("Y", "y"):
-    INIT_COND = random_string(LEN_INIT)
-else:
-    INIT_COND = []
-    print("Choose between 0,1 or 2 as each element of the initial condition one by one")
-    for _ in range(0, LEN_INIT):
-        INIT_COND.append(int(input()))
+    if random_init in ("Y", "y"):
+        init_cond = random_string(len_init)
+    else:
+        init_cond = []
+        print("Choose between 0,1 or 2 as each element of the initial condition one by one")
+        for _ in range(0, len_init):
+            init_cond.append(int(input()))
 
-print("The initial conditions chosen by you is", INIT_COND)
+    print("The initial conditions chosen by you is", init_cond)
 
-# Choose the number of timesteps for evolution
+    # Choose the number of timesteps for evolution
 
-TIME = int(input("Choose the number of timesteps for evolution:"))
+    time = int(input("Choose the number of timesteps for evolution:"))
 
-# We will call the function run_three_state_CA to run the evolution
+    return rule_num, init_cond, time
+
+
+def main(argv=None):
+    """Command line entry point of the three state CA.
+
+    Without --rule, the rule number, initial condition and number of
+    timesteps are asked for interactively, as before. With --rule, they
+    are taken from the flags; --batch then skips plotting and prints
+    the transient, period and last configuration instead, so the run
+    needs neither a display nor matplotlib.
+    """
 
-run_three_state_ca(RULE_NUM, INIT_COND, TIME)
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rule", type=int, default=None)
+    parser.add_argument("--length", type=int, default=100)
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--init", default=None, help="initial condition as a string of 0s, 1s and 2s"
+    )
+    parser.add_argument(
+        "--output", default=None, help="save the diagram (or .npy field) here"
+    )
+    parser.add_argument("--batch", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.rule is None:
+        rule_num, init_cond, time = prompt_arguments()
+        run_three_state_ca(rule_num, init_cond, time, path=args.output)
+        return
+
+    random.seed(args.seed)
+
+    if args.init is None:
+        init_cond = random_string(args.length)
+    else:
+        init_cond = [int(cell) for cell in args.init]
+
+    rule_user = ThreeStateCA(args.rule, init_cond)
+    rule_user.evolve(args.steps, detect_cycles=args.batch)
+
+    if args.output is not None and args.output.endswith(".npy"):
+        np.save(args.output, rule_user.spacetime)
+    elif args.output is not None and args.output.endswith((".png", ".pgm")):
+        render.render(rule_user.spacetime, args.output, states=3)
+    elif not args.batch or args.output is not None:
+        spacetime_diagram(rule_user.spacetime, path=args.output)
+
+    if args.batch:
+        print("transient:", rule_user.transient)
+        print("period:", rule_user.period)
+        print("final:", "".join(str(cell) for cell in rule_user.spacetime[-1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,9 @@
 import random
-from matplotlib import pyplot as plt
+import itertools
+import numpy as np
+import rule_tables
+import spacetime_store
+from streaming import find_cycle, iter_blocks, tile_cycle
 
 def random_string(length):
     '''
@@ -42,17 +46,44 @@ def lookup_table(rule_number):
         Lookup table dictionary that maps neighborhood tuples to their output according to the 
         ECA local evolution rule (i.e. the lookup table), as specified by the rule number. 
     '''
-    if not isinstance(rule_number, int) or rule_number < 0 or rule_number > 255:
-        raise ValueError("rule_number must be an int between 0 and 255, inclusive")
-    neighborhoods = [(0,0,0), (0,0,1), (0,1,0), (0,1,1), (1,0,0), (1,0,1), (1,1,0), (1,1,1)]
-    in_binary = '{:{fill}{align}{width}b}'.format(rule_number, 
-                                                  fill='0', 
-                                                  align='>', 
-                                                  width='8')
+    # the outputs come from the precompiled table of the rule (see rule_tables)
+    return dict(zip(neighborhoods(), compile_rule(rule_number).tolist()))
     
-    return dict(zip(neighborhoods, map(int,reversed(in_binary)))) # use map so that outputs are ints, not strings
+def compile_rule(rule_number):
+    '''
+    Returns the ECA lookup table as a read-only array of 8 uint8 outputs, where the neighborhood
+    (left, center, right) is found at index 4*left + 2*center + right. The table is shared
+    with every other caller through the rule_tables registry.
+    '''
+    return rule_tables.eca_table(rule_number)
+
+def neighborhood_codes(configuration):
+    '''
+    Returns the index 4*left + 2*center + right of every cell's neighborhood, as uint8.
+    The last axis is the (periodic) lattice.
+    '''
+    configuration = np.asarray(configuration, dtype=np.uint8)
+    return (4 * np.roll(configuration, 1, axis=-1) + 2 * configuration 
+            + np.roll(configuration, -1, axis=-1))
+
+def evolve_step(configuration, rule_array, out=None):
+    '''
+    Returns the configuration one time step later, using the compiled rule (see compile_rule).
+    Stacks of configurations (lattice on the last axis) are evolved together.
+    '''
+    return np.take(rule_array, neighborhood_codes(configuration), out=out)
     
-def spacetime_field(rule_number, initial_condition, time_steps):
+def attractor(rule_number, initial_condition, max_steps):
+    '''
+    Returns (transient, period) of the orbit of the initial condition: the time at which
+    the configuration first falls into a periodic orbit and the period of that orbit.
+    Both are None if no configuration repeats within max_steps time steps.
+    '''
+    # find_cycle reads the unbounded stream twice, never past time 3*max_steps
+    return find_cycle(lambda: iter_spacetime(rule_number, initial_condition), max_steps)
+
+def spacetime_field(rule_number, initial_condition, time_steps, detect_cycles=False,
+                    return_cycle=False):
     '''
     Returns a spacetime field array using the given rule number on the 
     given initial condition for the given number of time steps.
@@ -67,6 +98,13 @@ def spacetime_field(rule_number, initial_condition, time_steps):
         should be ints. 
     time_steps: int
         Positive integer specifying the number of time steps for evolving the ECA. 
+    detect_cycles: bool, optional (default=False)
+        If True, evolution stops at the first repeated configuration and the remaining
+        time steps are filled in by tiling the periodic orbit (see attractor).
+    return_cycle: bool, optional (default=False)
+        If True, returns (spacetime_field, transient, period), where transient and period
+        are those of attractor(rule_number, initial_condition, time_steps), found without
+        running the rule again. Requires detect_cycles.
     '''
     if time_steps < 0:
         raise ValueError("time_steps must be a non-negative integer")
@@ -81,6 +119,17 @@ def spacetime_field(rule_number, initial_condition, time_steps):
         if i not in [0,1]:
             raise ValueError("initial condition must be a list of 0s and 1s")
         
+    if return_cycle and not detect_cycles:
+        raise ValueError("return_cycle requires detect_cycles")
+
+    if detect_cycles:
+        field, transient, period = tile_cycle(
+            iter_spacetime(rule_number, initial_condition, time_steps), time_steps)
+        field = [initial_condition] + field[1:].tolist()
+        if return_cycle:
+            return field, transient, period
+        return field
+    
     lookup = lookup_table(rule_number)
     length = len(initial_condition)
     
@@ -104,9 +153,195 @@ def spacetime_field(rule_number, initial_condition, time_steps):
     
     return spacetime_field
     
-def spacetime_diagram(spacetime_field, size=12, colors=plt.cm.Greys):
+def batch_spacetime_fields(rule_numbers, initial_conditions, time_steps):
+    '''
+    Evolves every initial condition under every rule number in one vectorized pass.
+    
+    Parameters
+    ----------
+    rule_numbers: array-like
+        Sequence of R ints between 0 and 255, inclusive (Wolfram numbering scheme).
+    initial_conditions: array-like (2D)
+        Stack of S binary strings of length N, given as an (S, N) array or list of lists.
+    time_steps: int
+        Positive integer specifying the number of time steps for evolving the ECAs.
+        
+    Returns
+    -------
+    out: numpy.ndarray
+        (R, S, T+1, N) uint8 array, so that out[r, s] is the spacetime field of
+        rule_numbers[r] applied to initial_conditions[s].
+    '''
+    if time_steps < 0:
+        raise ValueError("time_steps must be a non-negative integer")
+    try:
+        time_steps = int(time_steps)
+    except ValueError:
+        raise ValueError("time_steps must be a non-negative integer")
+    
+    initial_conditions = np.atleast_2d(np.asarray(initial_conditions))
+    if not np.isin(initial_conditions, [0,1]).all():
+        raise ValueError("initial conditions must be lists of 0s and 1s")
+    rule_arrays = rule_tables.eca_tables(rule_numbers)
+    # offset each rule's neighborhoods into its own row of the flattened rule arrays
+    offsets = 8 * np.arange(len(rule_arrays)).reshape(-1, 1, 1)
+    
+    fields = np.empty((len(rule_arrays),) + initial_conditions.shape[:1] 
+                      + (time_steps + 1,) + initial_conditions.shape[1:], dtype=np.uint8)
+    fields[:, :, 0] = initial_conditions
+    for t in range(time_steps):
+        fields[:, :, t+1] = np.take(rule_arrays, offsets + neighborhood_codes(fields[:, :, t]))
+    return fields
+
+def iter_spacetime(rule_number, initial_condition, time_steps=None, block_size=None):
+    '''
+    Generator version of spacetime_field that keeps only the current configuration in memory.
+    See streaming.consume for attaching a ring buffer and summary statistics to it.
+    
+    Parameters
+    ----------
+    rule_number: int
+        Integer value between 0 and 255, inclusive. Specifies the ECA lookup table
+        according to the Wolfram numbering scheme.
+    initial_condition: array-like
+        Binary string used as the initial condition for the ECA.
+    time_steps: int, optional (default=None)
+        Non-negative number of time steps. The stream never ends if None.
+    block_size: int, optional (default=None)
+        If given, yields (block_size, N) blocks of consecutive rows instead of single rows.
+        
+    Yields
+    ------
+    out: numpy.ndarray
+        uint8 configurations at times 0, 1, ..., time_steps (or blocks of them).
+    '''
+    if time_steps is not None:
+        if time_steps < 0:
+            raise ValueError("time_steps must be a non-negative integer")
+        try:
+            time_steps = int(time_steps)
+        except ValueError:
+            raise ValueError("time_steps must be a non-negative integer")
+    initial_condition = np.asarray(initial_condition)
+    if not np.isin(initial_condition, [0,1]).all():
+        raise ValueError("initial condition must be a list of 0s and 1s")
+    rule = compile_rule(rule_number)
+    
+    def rows():
+        configuration = initial_condition.astype(np.uint8)
+        yield configuration
+        for _ in itertools.count() if time_steps is None else range(time_steps):
+            configuration = evolve_step(configuration, rule)
+            yield configuration
+            
+    if block_size is None:
+        return rows()
+    return iter_blocks(rows(), block_size)
+
+def record_spacetime(path, rule_number, initial_condition, time_steps, block_size=1024):
+    '''
+    Writes the spacetime field straight into a bit-packed, memory-mapped .npy file at path
+    as the run progresses, resuming from the last stored row if the run was interrupted.
+    Returns a spacetime_store.SpacetimeStore, which can be sliced like a (T+1, N) array.
+    '''
+    return spacetime_store.record(path, iter_spacetime, rule_number, initial_condition, 
+                                  time_steps, states=2, block_size=block_size)
+
+def pack_configuration(configuration):
+    '''
+    Packs a binary configuration into uint64 words, 64 cells per word.
+    
+    Cell i is stored in bit i%64 of word i//64. The unused high bits of the last word are 0.
+    Leading axes are kept, so a (T, N) spacetime field packs to a (T, ceil(N/64)) array.
+    '''
+    bits = np.asarray(configuration, dtype=np.uint8)
+    length = bits.shape[-1]
+    padded = np.zeros(bits.shape[:-1] + (-(-length // 64) * 64,), dtype=np.uint8)
+    padded[..., :length] = bits
+    return np.packbits(padded, axis=-1, bitorder='little').view('<u8').astype(np.uint64)
+
+def unpack_configuration(words, length):
+    '''
+    Inverse of pack_configuration. Returns a uint8 array whose last axis has the given length.
+    '''
+    as_bytes = np.ascontiguousarray(words, dtype='<u8').view(np.uint8)
+    return np.unpackbits(as_bytes, axis=-1, bitorder='little')[..., :length]
+
+def packed_step(words, rule_number, length):
+    '''
+    Evolves a packed configuration (see pack_configuration) of the given length by one time step.
+    
+    The rule is evaluated as an OR of minterms over the left-shifted, unshifted and right-shifted
+    words, so 64 cells are updated per operation. Periodic boundaries wrap across word edges. 
+    '''
+    last = np.uint64((length - 1) % 64)
+    one = np.uint64(1)
+    # left[i] holds the left neighbor of cell i, right[i] its right neighbor
+    left = words << one
+    left[1:] |= words[:-1] >> np.uint64(63)
+    left[0] |= (words[-1] >> last) & one
+    right = words >> one
+    right[:-1] |= words[1:] << np.uint64(63)
+    right[-1] |= (words[0] & one) << last
+    
+    cells = {0: (~left, ~words, ~right), 1: (left, words, right)}
+    new_words = np.zeros_like(words)
+    for (l, c, r), output in zip(neighborhoods(), compile_rule(rule_number)):
+        if output:
+            new_words |= cells[l][0] & cells[c][1] & cells[r][2]
+    # clear the padding bits so they never leak into the wraparound
+    new_words[-1] &= np.uint64((1 << (int(last) + 1)) - 1)
+    return new_words
+
+def packed_spacetime_field(rule_number, initial_condition, time_steps, unpack=False):
+    '''
+    Bit-packed version of spacetime_field, for lattices of millions of cells.
+    
+    Parameters
+    ----------
+    rule_number: int
+        Integer value between 0 and 255, inclusive. Specifies the ECA lookup table
+        according to the Wolfram numbering scheme.
+    initial_condition: array-like
+        Binary string used as the initial condition for the ECA.
+    time_steps: int
+        Positive integer specifying the number of time steps for evolving the ECA.
+    unpack: bool, optional (default=False)
+        If True, returns the unpacked (T+1, N) uint8 spacetime field instead of the packed one.
+        
+    Returns
+    -------
+    out: numpy.ndarray
+        (T+1, ceil(N/64)) uint64 array of packed rows (see pack_configuration), or the
+        (T+1, N) uint8 spacetime field if unpack is True.
+    '''
+    if time_steps < 0:
+        raise ValueError("time_steps must be a non-negative integer")
+    try:
+        time_steps = int(time_steps)
+    except ValueError:
+        raise ValueError("time_steps must be a non-negative integer")
+    
+    initial_condition = np.asarray(initial_condition)
+    if not np.isin(initial_condition, [0,1]).all():
+        raise ValueError("initial condition must be a list of 0s and 1s")
+    compile_rule(rule_number) # validates the rule number
+    length = len(initial_condition)
+    
+    packed_field = np.empty((time_steps + 1, -(-length // 64)), dtype=np.uint64)
+    packed_field[0] = pack_configuration(initial_condition)
+    if length:
+        for t in range(time_steps):
+            packed_field[t+1] = packed_step(packed_field[t], rule_number, length)
+    
+    if unpack:
+        return unpack_configuration(packed_field, length)
+    return packed_field
+    
+def spacetime_diagram(spacetime_field, size=12, colors=None, path=None):
     '''
     Produces a simple spacetime diagram image using matplotlib imshow with 'nearest' interpolation.
+    matplotlib is only imported here, so the rest of the module does not need it.
     
    Parameters
     ---------
@@ -116,10 +351,19 @@ def spacetime_diagram(spacetime_field, size=12, colors=plt.cm.Greys):
         
     size: int, optional (default=12)
         Sets the size of the figure: figsize=(size,size)
-    colors: matplotlib colormap, optional (default=plt.cm.Greys)
+    colors: matplotlib colormap or name, optional (default="Greys")
         See https://matplotlib.org/tutorials/colors/colormaps.html for colormap choices.
         A colormap 'cmap' is called as: colors=plt.cm.cmap
+    path: str, optional (default=None)
+        If given, the image is saved to this file instead of shown.
     '''
+    from matplotlib import pyplot as plt
+    if colors is None:
+        colors = 'Greys'
     plt.figure(figsize=(size,size))
     plt.imshow(spacetime_field, cmap=colors, interpolation='nearest')
-    plt.show()
+    if path is None:
+        plt.show()
+    else:
+        plt.savefig(path)
+        plt.close()